@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLog:
+    """Write-behind activity log: events are queued in memory and inserted in batches by a background task"""
+
+    def __init__(
+        self,
+        db,
+        max_queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval_seconds: float = 1.0,
+        enqueue_timeout_seconds: float = 0.5,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.enqueue_timeout_seconds = enqueue_timeout_seconds
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._flush_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task and flush whatever is still queued"""
+        if self._task is not None:
+            # Let an in-progress insert finish rather than cancelling it and losing the batch
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def record(self, event: dict) -> bool:
+        """Queue an event; when the queue is full wait briefly for a flush, then drop it"""
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._flush_requested.set()
+            try:
+                await asyncio.wait_for(self._queue.put(event), self.enqueue_timeout_seconds)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                logger.warning("Activity queue full, dropped event (%d dropped so far)", self.dropped)
+                return False
+
+        if self._queue.qsize() >= self.batch_size:
+            self._flush_requested.set()
+        return True
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Insert everything currently queued, batch_size events per insert_many"""
+        written = 0
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self.db.activity.insert_many(batch, ordered=False)
+                written += len(batch)
+            except Exception:
+                self.dropped += len(batch)
+                logger.exception("Failed to write %d activity events", len(batch))
+        return written
@@ -0,0 +1,194 @@
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from models import LeadStatus
+from scopes import OwnerScoped
+
+# Leads and customers are pulled in batches of this many documents
+ANALYTICS_BATCH_SIZE = 5000
+
+PERCENTILES = [25, 50, 75, 90, 95, 99]
+
+# Upper edges of the value bands used for win-rate reporting
+VALUE_BAND_EDGES = [0, 1000, 5000, 10000, 25000, 50000, np.inf]
+
+# Probability that a lead in each stage eventually converts
+STAGE_PROBABILITIES = {
+    LeadStatus.NEW.value: 0.1,
+    LeadStatus.CONTACTED.value: 0.4,
+    LeadStatus.CONVERTED.value: 1.0,
+    LeadStatus.LOST.value: 0.0,
+}
+
+OPEN_STATUSES = [LeadStatus.NEW.value, LeadStatus.CONTACTED.value]
+
+CUSTOMER_FIELDS = ['id', 'owner_id', 'company']
+LEAD_FIELDS = ['customer_id', 'status', 'value']
+
+
+async def load_frame(collection, query: dict, fields: List[str], batch_size: int = ANALYTICS_BATCH_SIZE) -> pd.DataFrame:
+    """Load only the projected fields of matching documents into a DataFrame, one batch at a time"""
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 0
+
+    cursor = collection.find(query, projection).batch_size(batch_size)
+    frames = []
+    while True:
+        batch = await cursor.to_list(length=batch_size)
+        if not batch:
+            break
+        frames.append(pd.DataFrame.from_records(batch, columns=fields))
+
+    if not frames:
+        return pd.DataFrame(columns=fields)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _conversion_table(leads: pd.DataFrame, key: str) -> pd.DataFrame:
+    converted = leads['status'].eq(LeadStatus.CONVERTED.value)
+    lost = leads['status'].eq(LeadStatus.LOST.value)
+    table = pd.DataFrame({
+        key: leads[key],
+        'total_leads': 1,
+        'converted': converted.astype(np.int64),
+        'lost': lost.astype(np.int64),
+    }).groupby(key, sort=False).sum()
+    table['conversion_rate'] = table['converted'] / table['total_leads']
+    return table.sort_values(['conversion_rate', 'total_leads'], ascending=False).reset_index()
+
+
+def _value_band_table(leads: pd.DataFrame) -> List[dict]:
+    labels = []
+    for low, high in zip(VALUE_BAND_EDGES[:-1], VALUE_BAND_EDGES[1:]):
+        labels.append(f"{low:g}+" if np.isinf(high) else f"{low:g}-{high:g}")
+
+    values = leads['value'].to_numpy(dtype=np.float64)
+    band_index = np.searchsorted(VALUE_BAND_EDGES[1:-1], values, side='right')
+    converted = leads['status'].eq(LeadStatus.CONVERTED.value).to_numpy()
+    closed = converted | leads['status'].eq(LeadStatus.LOST.value).to_numpy()
+
+    bands = len(labels)
+    totals = np.bincount(band_index, minlength=bands)
+    closed_counts = np.bincount(band_index, weights=closed, minlength=bands).astype(np.int64)
+    converted_counts = np.bincount(band_index, weights=converted, minlength=bands).astype(np.int64)
+    win_rates = np.divide(
+        converted_counts, closed_counts,
+        out=np.zeros(bands, dtype=np.float64), where=closed_counts > 0,
+    )
+
+    return [
+        {
+            "band": labels[i],
+            "min_value": float(VALUE_BAND_EDGES[i]),
+            "max_value": None if np.isinf(VALUE_BAND_EDGES[i + 1]) else float(VALUE_BAND_EDGES[i + 1]),
+            "total_leads": int(totals[i]),
+            "closed": int(closed_counts[i]),
+            "converted": int(converted_counts[i]),
+            "win_rate": float(win_rates[i]),
+        }
+        for i in range(bands)
+    ]
+
+
+def _forecast(leads: pd.DataFrame) -> dict:
+    probabilities = leads['status'].map(STAGE_PROBABILITIES).fillna(0.0).to_numpy(dtype=np.float64)
+    values = leads['value'].to_numpy(dtype=np.float64)
+    is_open = leads['status'].isin(OPEN_STATUSES).to_numpy()
+
+    weighted = values * probabilities
+    by_status = pd.Series(weighted).groupby(leads['status'].to_numpy()).sum()
+
+    return {
+        "open_value": float(values[is_open].sum()),
+        "weighted_value": float(weighted[is_open].sum()),
+        "by_status": {
+            status.value: float(by_status.get(status.value, 0.0))
+            for status in LeadStatus
+        },
+    }
+
+
+def summarize_pipeline(leads: pd.DataFrame, customers: pd.DataFrame, owner_names: Optional[Dict[str, str]] = None) -> dict:
+    """Compute pipeline metrics from lead and customer frames without per-document loops"""
+    owner_names = owner_names or {}
+    leads = leads.merge(
+        customers.rename(columns={'id': 'customer_id'}),
+        on='customer_id', how='inner',
+    )
+    leads['value'] = pd.to_numeric(leads['value'], errors='coerce').fillna(0.0)
+    leads['status'] = leads['status'].fillna(LeadStatus.NEW.value).astype(str)
+    leads['company'] = leads['company'].fillna('').astype(str)
+
+    values = leads['value'].to_numpy(dtype=np.float64)
+    if len(values):
+        percentile_values = np.percentile(values, PERCENTILES)
+    else:
+        percentile_values = np.zeros(len(PERCENTILES))
+
+    by_owner = _conversion_table(leads, 'owner_id')
+    by_owner['owner_name'] = by_owner['owner_id'].map(owner_names)
+    by_owner = by_owner.astype(object).where(by_owner.notna(), None)
+
+    return {
+        "total_leads": int(len(leads)),
+        "total_value": float(values.sum()),
+        "value_percentiles": {
+            f"p{p}": float(v) for p, v in zip(PERCENTILES, percentile_values)
+        },
+        "conversion_by_owner": by_owner.to_dict('records'),
+        "conversion_by_company": _conversion_table(leads, 'company').to_dict('records'),
+        "win_rate_by_value_band": _value_band_table(leads),
+        "forecast": _forecast(leads),
+    }
+
+
+async def compute_pipeline_analytics(db, owner_id: Optional[str] = None, include_archived: bool = False) -> dict:
+    """Load the leads visible to owner_id (all leads when None) and summarize them"""
+    customer_query = {} if owner_id is None else {"owner_id": owner_id}
+    customers = await load_frame(db.customers, customer_query, CUSTOMER_FIELDS)
+
+    if owner_id is None:
+        leads_query = {}
+    else:
+        leads_query = {"customer_id": {"$in": customers['id'].tolist()}}
+    leads = await load_frame(db.leads, leads_query, LEAD_FIELDS)
+    if include_archived:
+        archived = await load_frame(db.leads_archive, leads_query, LEAD_FIELDS)
+        leads = pd.concat([leads, archived], ignore_index=True)
+
+    owner_ids = customers['owner_id'].dropna().unique().tolist()
+    users = await db.users.find({"id": {"$in": owner_ids}}, {"_id": 0, "id": 1, "name": 1}).to_list(length=None)
+    owner_names = {user['id']: user.get('name') for user in users}
+
+    return summarize_pipeline(leads, customers, owner_names)
+
+
+class AnalyticsCache(OwnerScoped):
+    """Per-owner cache of computed analytics, dropped whenever that owner's data changes"""
+
+    def __init__(self, ttl_seconds: float = 300):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, tuple] = {}
+
+    def _scoped_entries(self) -> List[dict]:
+        return [self._entries]
+
+    def get(self, owner_id: Optional[str]):
+        key = self.scope(owner_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            self._entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, owner_id: Optional[str], value, generation: Optional[int] = None) -> None:
+        if generation is not None and generation != self.generation:
+            return
+        self._entries[self.scope(owner_id)] = (time.monotonic() + self.ttl_seconds, value)
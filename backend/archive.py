@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Callable, List, Optional
+
+from pymongo import ReplaceOne, ReturnDocument
+
+from jobs import acquire_lease
+from models import LeadStatus
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "lead_archiving"
+
+CLOSED_STATUSES = [LeadStatus.CONVERTED.value, LeadStatus.LOST.value]
+
+# Leads moved per round trip
+ARCHIVE_BATCH_SIZE = 500
+
+
+def archivable_query(cutoff: datetime) -> dict:
+    """Closed leads untouched since cutoff; leads written before updated_at existed fall back to created_at"""
+    return {
+        "status": {"$in": CLOSED_STATUSES},
+        "$or": [
+            {"updated_at": {"$lt": cutoff.isoformat()}},
+            {"updated_at": None, "created_at": {"$lt": cutoff.isoformat()}},
+        ],
+    }
+
+
+def sort_leads(leads: List[dict], sort_spec: Optional[list]) -> List[dict]:
+    """Order leads from both collections the way Mongo would order one, missing values lowest"""
+    for field, direction in reversed(sort_spec or []):
+        leads.sort(key=lambda lead: (0,) if lead.get(field) is None else (1, lead[field]), reverse=direction < 0)
+    return leads
+
+
+async def load_leads(db, query: dict, sort_spec: Optional[list] = None, include_archived: bool = False) -> List[dict]:
+    """Leads matching query from the hot collection, plus the archive when asked"""
+    collections = [db.leads, db.leads_archive] if include_archived else [db.leads]
+    leads = []
+    for collection in collections:
+        cursor = collection.find(query)
+        if sort_spec:
+            cursor = cursor.sort(sort_spec)
+        leads += await cursor.to_list(length=None)
+    return sort_leads(leads, sort_spec) if include_archived else leads
+
+
+async def restore_lead(db, lead: dict, session=None) -> None:
+    """Move an archived lead back to the hot collection, e.g. because it is being edited again"""
+    restored = {key: value for key, value in lead.items() if key not in ("_id", "archived_at")}
+    await db.leads.replace_one({"id": lead['id']}, restored, upsert=True, session=session)
+    await db.leads_archive.delete_one({"id": lead['id']}, session=session)
+
+
+async def apply_lead_update(db, lead_id: str, update: dict, session=None) -> Optional[dict]:
+    """Apply update to a lead and return the result, or None if the lead no longer exists.
+
+    A lead found in the archive, including one archived after the caller read it, is restored
+    first so the update always lands on a hot lead.
+    """
+    for _ in range(2):
+        updated = await db.leads.find_one_and_update(
+            {"id": lead_id}, update,
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER, session=session,
+        )
+        if updated is not None:
+            return updated
+        archived = await db.leads_archive.find_one({"id": lead_id}, session=session)
+        if archived is None:
+            return None
+        await restore_lead(db, archived, session=session)
+    return None
+
+
+class LeadArchiveJob:
+    """Periodically moves leads closed for longer than max_age_days from db.leads into db.leads_archive"""
+
+    def __init__(
+        self,
+        db,
+        max_age_days: float = 180,
+        interval_seconds: float = 3600,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        lease_seconds: float = 600,
+        on_archived: Optional[Callable[[], None]] = None,
+    ):
+        self.db = db
+        self.max_age_days = max_age_days
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.on_archived = on_archived
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lead archiving run failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def _archive_batch(self, query: dict, archived_at: str) -> tuple:
+        """Copy one batch into the archive, then delete it from the hot collection; returns (read, moved)"""
+        leads = await self.db.leads.find(query, {"_id": 0}).limit(self.batch_size).to_list(length=None)
+        if not leads:
+            return 0, 0
+
+        # Upserts keep a batch that was copied but not deleted by an interrupted run from duplicating
+        await self.db.leads_archive.bulk_write(
+            [ReplaceOne({"id": lead['id']}, {**lead, "archived_at": archived_at}, upsert=True) for lead in leads],
+            ordered=False,
+        )
+        lead_ids = [lead['id'] for lead in leads]
+        result = await self.db.leads.delete_many({**query, "id": {"$in": lead_ids}})
+        if result.deleted_count < len(lead_ids):
+            # Leads edited after they were copied stay hot; drop their stale archived copies
+            kept = await self.db.leads.distinct("id", {"id": {"$in": lead_ids}})
+            if kept:
+                await self.db.leads_archive.delete_many({"id": {"$in": kept}})
+        return len(leads), result.deleted_count
+
+    async def run(self) -> Optional[dict]:
+        """Archive every eligible lead and return a run summary, or None if another run holds the lease"""
+        started_at = datetime.now(timezone.utc)
+        if await acquire_lease(self.db, JOB_NAME, started_at, self.lease_seconds) is None:
+            return None
+
+        query = archivable_query(started_at - timedelta(days=self.max_age_days))
+        archived = 0
+        try:
+            while True:
+                read, moved = await self._archive_batch(query, started_at.isoformat())
+                archived += moved
+                if read < self.batch_size:
+                    break
+        finally:
+            await self.db.jobs.update_one({"name": JOB_NAME}, {"$unset": {"locked_until": ""}})
+            if archived and self.on_archived is not None:
+                self.on_archived()
+
+        finished_at = datetime.now(timezone.utc)
+        logger.info("Archived %d leads in %.2fs", archived, (finished_at - started_at).total_seconds())
+        return {"archived": archived, "started_at": started_at, "finished_at": finished_at}
@@ -0,0 +1,156 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from jobs import backfill
+from scopes import OwnerScoped
+
+MAX_LIMIT = 20
+
+# Candidates fetched per query; ranking happens on this small set in memory
+CANDIDATE_LIMIT = 50
+
+# Prefixes remembered per scope, and scopes remembered overall
+MAX_PREFIXES_PER_SCOPE = 256
+MAX_SCOPES = 1000
+
+
+def normalize(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def customer_search_fields(customer: dict) -> dict:
+    """Lowercase name, company and their words, indexed for prefix lookups in ranking order"""
+    terms = set()
+    for text in (customer.get('name'), customer.get('company')):
+        normalized = normalize(text)
+        if normalized:
+            terms.add(normalized)
+            terms.update(word for word in re.split(r"[^a-z0-9]+", normalized) if word)
+    return {
+        "search_name": normalize(customer.get('name')),
+        "search_company": normalize(customer.get('company')),
+        "search_terms": sorted(terms),
+    }
+
+
+def _rank(customer: dict, prefix: str) -> tuple:
+    name = normalize(customer.get('name'))
+    company = normalize(customer.get('company'))
+    if name.startswith(prefix):
+        rank = 0
+    elif company.startswith(prefix):
+        rank = 1
+    else:
+        rank = 2
+    return rank, name
+
+
+# Fields matched in turn, best rank first; a later tier is only read when the earlier ones ran out
+RANK_TIERS = ["search_name", "search_company", "search_terms"]
+
+
+def _matches(customer: dict, prefix: str) -> bool:
+    return any(term.startswith(prefix) for term in customer['search_terms'])
+
+
+class PrefixCache(OwnerScoped):
+    """Per-scope LRU of prefix results; a complete result also answers every longer prefix until it expires"""
+
+    def __init__(self, ttl_seconds: float = 60):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self._scopes: "OrderedDict[str, OrderedDict[str, tuple]]" = OrderedDict()
+
+    def _scoped_entries(self) -> List[dict]:
+        return [self._scopes]
+
+    def lookup(self, owner_id: Optional[str], prefix: str) -> Optional[List[dict]]:
+        scope = self._scopes.get(self.scope(owner_id))
+        if scope is None:
+            return None
+        now = time.monotonic()
+        for length in range(len(prefix), 0, -1):
+            entry = scope.get(prefix[:length])
+            if entry is None:
+                continue
+            expires_at, candidates, complete = entry
+            if now >= expires_at:
+                del scope[prefix[:length]]
+                continue
+            if length == len(prefix):
+                scope.move_to_end(prefix)
+                return candidates
+            if complete:
+                return [candidate for candidate in candidates if _matches(candidate, prefix)]
+        return None
+
+    def store(self, owner_id: Optional[str], prefix: str, candidates: List[dict], complete: bool, generation: int) -> None:
+        if generation != self.generation:
+            return
+        key = self.scope(owner_id)
+        scope = self._scopes.setdefault(key, OrderedDict())
+        self._scopes.move_to_end(key)
+        scope[prefix] = (time.monotonic() + self.ttl_seconds, candidates, complete)
+        scope.move_to_end(prefix)
+        if len(scope) > MAX_PREFIXES_PER_SCOPE:
+            scope.popitem(last=False)
+        if len(self._scopes) > MAX_SCOPES:
+            self._scopes.popitem(last=False)
+
+
+async def _ranked_candidates(db, owner_id: Optional[str], prefix: str) -> List[dict]:
+    """The best CANDIDATE_LIMIT matches by rank, read tier by tier so a full tier never hides a better one"""
+    pattern = {"$regex": f"^{re.escape(prefix)}"}
+    candidates: List[dict] = []
+    for field in RANK_TIERS:
+        mongo_query: Dict = {field: pattern}
+        if owner_id is not None:
+            mongo_query['owner_id'] = owner_id
+        if candidates:
+            # Earlier tiers were read to the end, so skipping what they returned skips all of them
+            mongo_query['id'] = {"$nin": [candidate['id'] for candidate in candidates]}
+        candidates += await db.customers.find(
+            mongo_query,
+            {"_id": 0, "id": 1, "name": 1, "company": 1, "search_terms": 1},
+        ).sort("search_name", 1).limit(CANDIDATE_LIMIT - len(candidates)).to_list(length=None)
+        if len(candidates) >= CANDIDATE_LIMIT:
+            break
+    return candidates
+
+
+async def autocomplete(db, cache: PrefixCache, owner_id: Optional[str], query: str, limit: int) -> List[dict]:
+    """Top matches whose name, company or one of their words starts with query"""
+    prefix = normalize(query)
+    if not prefix:
+        return []
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    candidates = cache.lookup(owner_id, prefix)
+    if candidates is None:
+        generation = cache.generation
+        candidates = await _ranked_candidates(db, owner_id, prefix)
+        cache.store(owner_id, prefix, candidates, len(candidates) < CANDIDATE_LIMIT, generation)
+
+    ranked = sorted(candidates, key=lambda customer: _rank(customer, prefix))
+    return [
+        {"id": customer['id'], "name": customer['name'], "company": customer['company']}
+        for customer in ranked[:limit]
+    ]
+
+
+async def _search_updates(customers: List[dict]) -> List[UpdateOne]:
+    return [UpdateOne({"id": customer['id']}, {"$set": customer_search_fields(customer)}) for customer in customers]
+
+
+async def backfill_search_terms(db) -> int:
+    """Compute search fields for customers created before they existed"""
+    return await backfill(
+        db.customers,
+        {"search_name": {"$exists": False}},
+        {"id": 1, "name": 1, "company": 1},
+        _search_updates,
+    )
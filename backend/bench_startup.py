@@ -0,0 +1,88 @@
+"""Measure how long a fresh API process takes from launch to serving its first request.
+
+Usage: python bench_startup.py [--runs 5] [--port 8765]
+
+Needs the MongoDB configured in .env to be reachable, since the app pings it during startup.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent
+
+
+def measure_import() -> float:
+    """Seconds spent importing the server module in a fresh interpreter"""
+    output = subprocess.check_output(
+        [sys.executable, "-c", "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"],
+        cwd=ROOT_DIR,
+        stderr=subprocess.DEVNULL,
+    )
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def measure_startup(port: int, timeout: float = 60.0) -> dict:
+    """Launch uvicorn and time until /readyz answers, then time the first API request"""
+    launched = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR,
+        env=os.environ.copy(),
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as http:
+            while True:
+                if time.perf_counter() - launched > timeout:
+                    raise RuntimeError(f"Server not ready after {timeout}s")
+                if process.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {process.returncode}")
+                try:
+                    if http.get("/readyz").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            ready = time.perf_counter()
+
+            # Unauthenticated, so this measures routing, validation and one Mongo round trip
+            http.post("/api/auth/login", json={"email": "bench@example.com", "password": "bench"})
+            first_request = time.perf_counter()
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {
+        "ready": ready - launched,
+        "first_request": first_request - ready,
+        "total": first_request - launched,
+    }
+
+
+def summarize(name: str, samples: list) -> None:
+    print(f"{name:<16} min {min(samples):.3f}s  median {statistics.median(samples):.3f}s  max {max(samples):.3f}s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    startups = [measure_startup(args.port) for _ in range(args.runs)]
+
+    summarize("import", imports)
+    summarize("launch to ready", [run["ready"] for run in startups])
+    summarize("first request", [run["first_request"] for run in startups])
+    summarize("launch to first", [run["total"] for run in startups])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
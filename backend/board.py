@@ -0,0 +1,111 @@
+import base64
+import binascii
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from jobs import backfill
+
+MAX_COLUMN_LIMIT = 100
+
+# Newest first; id breaks ties between leads created in the same instant
+BOARD_SORT = {"created_at": -1, "id": -1}
+
+
+def encode_cursor(lead: dict) -> str:
+    return base64.urlsafe_b64encode(f"{lead['created_at']}|{lead['id']}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Mongo condition selecting the leads after cursor; raises ValueError for a malformed cursor"""
+    try:
+        created_at, lead_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": lead_id}},
+    ]}
+
+
+def _column(status: str, leads: List[dict], limit: int, count: Optional[int], total_value: Optional[float]) -> dict:
+    has_more = len(leads) > limit
+    leads = leads[:limit]
+    return {
+        "status": status,
+        "count": count,
+        "total_value": total_value,
+        "leads": leads,
+        "next_cursor": encode_cursor(leads[-1]) if has_more else None,
+    }
+
+
+async def lead_board(db, scope: dict, statuses: List[str], limit: int, cursor: Optional[str] = None) -> List[dict]:
+    """Count, value and first page of leads for each status column, in one aggregation.
+
+    $facet sub-pipelines cannot use indexes, so the scope match and sort run first where the
+    (scope, status, created_at, id) indexes serve them as one ordered index scan; each column
+    then only keeps its first limit + 1 leads.
+
+    A cursor continues the single column in statuses. That page is a plain find that seeks to the
+    cursor in the same index and stops after limit + 1 leads; it leaves count and total_value as
+    None because the first page already carried them.
+    """
+    limit = max(1, min(limit, MAX_COLUMN_LIMIT))
+
+    if cursor:
+        status = statuses[0]
+        leads = await db.leads.find(
+            {**scope, "status": status, **decode_cursor(cursor)},
+            {"_id": 0},
+        ).sort(list(BOARD_SORT.items())).limit(limit + 1).to_list(length=None)
+        return [_column(status, leads, limit, None, None)]
+
+    facets: Dict[str, list] = {
+        "totals": [{"$group": {"_id": "$status", "count": {"$sum": 1}, "total_value": {"$sum": "$value"}}}],
+    }
+    for index, status in enumerate(statuses):
+        facets[f"column_{index}"] = [{"$match": {"status": status}}, {"$limit": limit + 1}, {"$project": {"_id": 0}}]
+
+    pipeline = [
+        {"$match": {**scope, "status": {"$in": statuses}}},
+        {"$sort": BOARD_SORT},
+        {"$facet": facets},
+    ]
+    result = (await db.leads.aggregate(pipeline).to_list(length=1))[0]
+
+    totals = {row['_id']: row for row in result['totals']}
+    return [
+        _column(
+            status,
+            result[f"column_{index}"],
+            limit,
+            totals.get(status, {}).get('count', 0),
+            totals.get(status, {}).get('total_value', 0),
+        )
+        for index, status in enumerate(statuses)
+    ]
+
+
+async def _owner_updates(db, leads: List[dict]) -> List[UpdateOne]:
+    customer_ids = list({lead['customer_id'] for lead in leads})
+    owners = {
+        customer['id']: customer['owner_id']
+        for customer in await db.customers.find(
+            {"id": {"$in": customer_ids}}, {"_id": 0, "id": 1, "owner_id": 1}
+        ).to_list(length=None)
+    }
+    return [
+        UpdateOne({"id": lead['id']}, {"$set": {"owner_id": owners[lead['customer_id']]}})
+        for lead in leads if lead['customer_id'] in owners
+    ]
+
+
+async def backfill_lead_owners(db) -> int:
+    """Copy the customer's owner onto leads written before leads carried one"""
+    return await backfill(
+        db.leads,
+        {"owner_id": {"$exists": False}},
+        {"id": 1, "customer_id": 1},
+        lambda leads: _owner_updates(db, leads),
+    )
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from scopes import OwnerScoped
+
+MAX_RESULTS = 1000
+
+
+class SingleFlight(OwnerScoped):
+    """Runs concurrent identical reads once and hands every caller the same result.
+
+    Keys are (route, scope, *normalized query); scope is an owner id, or ALL_OWNERS for admins.
+    With ttl_seconds set, a finished result also answers identical reads for that long.
+
+    Invalidating lets reads still in flight finish for the callers already waiting on them, but
+    later callers start a fresh one so they see the write.
+    """
+
+    def __init__(self, ttl_seconds: float = 0.0):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._results: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, route: str, counter: str) -> None:
+        stats = self._stats.setdefault(route, {"calls": 0, "executions": 0, "coalesced": 0, "reused": 0})
+        stats[counter] += 1
+
+    async def do(self, key: tuple, fn: Callable[[], Awaitable[Any]]) -> Any:
+        route = key[0]
+        self._count(route, "calls")
+
+        cached = self._results.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self._count(route, "reused")
+                return cached[1]
+            del self._results[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self._count(route, "executions")
+            # Run as its own task so a caller that disconnects does not cancel the read for the others
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            generation = self.generation
+            task.add_done_callback(lambda done: self._finished(key, done, generation))
+        else:
+            self._count(route, "coalesced")
+        return await asyncio.shield(task)
+
+    def _finished(self, key: tuple, task: asyncio.Task, generation: int) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.ttl_seconds > 0 and generation == self.generation:
+            self._results[key] = (time.monotonic() + self.ttl_seconds, task.result())
+            if len(self._results) > MAX_RESULTS:
+                self._results.popitem(last=False)
+
+    def _scoped_entries(self) -> List[dict]:
+        return [self._inflight, self._results]
+
+    def _scope_of(self, key: tuple) -> Hashable:
+        return key[1]
+
+    def stats(self) -> List[dict]:
+        """Per-route counters; coalescing_ratio is the share of calls that did not hit the database"""
+        return [
+            {
+                "route": route,
+                **counters,
+                "coalescing_ratio": round(1 - counters['executions'] / counters['calls'], 4) if counters['calls'] else 0.0,
+            }
+            for route, counters in sorted(self._stats.items())
+        ]
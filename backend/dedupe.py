@@ -0,0 +1,329 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
+from itertools import combinations
+from typing import List, Optional
+
+from pymongo import UpdateOne
+
+from jobs import acquire_lease, backfill, job_status
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "duplicate_scan"
+
+# Blocks larger than this are too generic to be useful and would make pairwise comparison quadratic
+MAX_BLOCK_SIZE = 50
+
+# Suggestions are written in batches of this size
+DEDUPE_BATCH_SIZE = 1000
+
+# Blocks whose members are read and compared together
+BLOCK_KEYS_PER_BATCH = 200
+
+BLOCK_MEMBER_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "owner_id": 1, "dedupe_keys": 1,
+    "email_key": 1, "phone_key": 1, "company_key": 1, "name_key": 1,
+}
+
+# Pairs scoring at or above this are stored as merge suggestions
+SUGGESTION_THRESHOLD = 0.6
+
+# Domains shared by unrelated people, so they are not used as a blocking key
+FREE_EMAIL_DOMAINS = {
+    "gmail.com", "googlemail.com", "yahoo.com", "hotmail.com", "outlook.com",
+    "live.com", "icloud.com", "aol.com", "protonmail.com", "gmx.com",
+}
+
+COMPANY_SUFFIXES = {
+    "inc", "incorporated", "llc", "ltd", "limited", "corp", "corporation",
+    "co", "company", "gmbh", "plc", "sa", "ag", "bv",
+}
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"), "l": "4", **dict.fromkeys("mn", "5"), "r": "6",
+}
+
+
+def normalize_email(email: str) -> str:
+    """Lowercase and drop any +tag from the local part"""
+    local, _, domain = (email or "").strip().lower().partition("@")
+    local = local.split("+", 1)[0]
+    return f"{local}@{domain}" if domain else local
+
+
+def normalize_phone(phone: str) -> str:
+    """Keep digits only, ignoring a leading country code beyond ten digits"""
+    digits = re.sub(r"\D", "", phone or "")
+    return digits[-10:]
+
+
+def normalize_company(company: str) -> str:
+    words = re.sub(r"[^a-z0-9 ]", " ", (company or "").lower()).split()
+    return " ".join(word for word in words if word not in COMPANY_SUFFIXES)
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(re.sub(r"[^a-z ]", " ", (name or "").lower()).split())
+
+
+def soundex(word: str) -> str:
+    word = re.sub(r"[^a-z]", "", word.lower())
+    if not word:
+        return ""
+    code = word[0].upper()
+    previous = SOUNDEX_CODES.get(word[0], "")
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+        if char not in "hw":
+            previous = digit
+    return (code + "000")[:4]
+
+
+def name_phonetic_key(name: str) -> str:
+    """Soundex of the first and last name, order-independent"""
+    words = normalize_name(name).split()
+    if not words:
+        return ""
+    return "-".join(sorted({soundex(words[0]), soundex(words[-1])}))
+
+
+def customer_dedupe_fields(customer: dict) -> dict:
+    """Normalized keys stored on each customer document for duplicate detection"""
+    email_key = normalize_email(customer.get('email', ''))
+    phone_key = normalize_phone(customer.get('phone', ''))
+    company_key = normalize_company(customer.get('company', ''))
+    name_key = name_phonetic_key(customer.get('name', ''))
+    domain = email_key.partition("@")[2]
+
+    blocks = [f"email:{email_key}"] if email_key else []
+    if len(phone_key) >= 7:
+        blocks.append(f"phone:{phone_key}")
+    if domain and domain not in FREE_EMAIL_DOMAINS:
+        blocks.append(f"domain:{domain}")
+    if company_key and name_key:
+        blocks.append(f"name:{company_key}:{name_key}")
+
+    return {
+        "email_key": email_key,
+        "phone_key": phone_key,
+        "company_key": company_key,
+        "name_key": name_key,
+        "dedupe_keys": blocks,
+    }
+
+
+def strong_keys(fields: dict) -> List[str]:
+    """Blocking keys that on their own identify the same person"""
+    return [key for key in fields['dedupe_keys'] if key.startswith(("email:", "phone:"))]
+
+
+async def find_duplicates(db, fields: dict, exclude_id: Optional[str] = None) -> List[dict]:
+    """Return existing customers sharing the email or phone, using a single lookup on the dedupe_keys index"""
+    keys = strong_keys(fields)
+    if not keys:
+        return []
+    query = {"dedupe_keys": {"$in": keys}}
+    if exclude_id:
+        query['id'] = {"$ne": exclude_id}
+    return await db.customers.find(query, BLOCK_MEMBER_PROJECTION).limit(MAX_BLOCK_SIZE).to_list(length=None)
+
+
+def match_score(a: dict, b: dict) -> tuple:
+    """Similarity of two customers in [0, 1] and the fields that matched"""
+    matched_on = []
+    score = 0.0
+    if a.get('email_key') and a.get('email_key') == b.get('email_key'):
+        matched_on.append("email")
+        score += 0.6
+    if a.get('phone_key') and a.get('phone_key') == b.get('phone_key'):
+        matched_on.append("phone")
+        score += 0.5
+    if a.get('company_key') and a.get('company_key') == b.get('company_key'):
+        matched_on.append("company")
+        score += 0.2
+    if a.get('name_key') and a.get('name_key') == b.get('name_key'):
+        matched_on.append("name")
+        score += 0.2
+    score += 0.3 * SequenceMatcher(None, normalize_name(a.get('name')), normalize_name(b.get('name'))).ratio()
+    return min(score, 1.0), matched_on
+
+
+async def _dedupe_updates(customers: List[dict]) -> List[UpdateOne]:
+    return [UpdateOne({"id": customer['id']}, {"$set": customer_dedupe_fields(customer)}) for customer in customers]
+
+
+async def backfill_dedupe_fields(db) -> int:
+    """Compute dedupe fields for customers created before they existed"""
+    return await backfill(
+        db.customers,
+        {"dedupe_keys": {"$exists": False}},
+        {"id": 1, "name": 1, "email": 1, "phone": 1, "company": 1},
+        _dedupe_updates,
+    )
+
+
+def _suggestion_update(a: dict, b: dict, score: float, matched_on: List[str], now: str) -> UpdateOne:
+    pair_id = ":".join(sorted([a['id'], b['id']]))
+    return UpdateOne(
+        {"pair_id": pair_id},
+        {
+            "$set": {
+                "customer_ids": sorted([a['id'], b['id']]),
+                "owner_ids": sorted({a.get('owner_id'), b.get('owner_id')} - {None}),
+                "score": round(score, 4),
+                "matched_on": matched_on,
+                "updated_at": now,
+            },
+            "$setOnInsert": {"pair_id": pair_id, "status": "open", "created_at": now},
+        },
+        upsert=True,
+    )
+
+
+async def suggest_merges(db, customer: dict, matches: List[dict]) -> int:
+    """Store a merge suggestion pairing customer with each of matches; returns the suggestions written"""
+    now = datetime.now(timezone.utc).isoformat()
+    operations = [_suggestion_update(customer, match, *match_score(customer, match), now) for match in matches]
+    if operations:
+        await db.customer_merge_suggestions.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+async def _compare_blocks(db, keys: List[str], now: str) -> int:
+    """Compare every pair inside the given blocks and upsert suggestions; returns the pairs compared"""
+    members = {key: [] for key in keys}
+    async for customer in db.customers.find({"dedupe_keys": {"$in": keys}}, BLOCK_MEMBER_PROJECTION):
+        for key in customer['dedupe_keys']:
+            if key in members:
+                members[key].append(customer)
+
+    compared = 0
+    operations = []
+    for block in members.values():
+        # A pair sharing several blocks is compared once per block; the upsert keeps one suggestion
+        for a, b in combinations(block, 2):
+            compared += 1
+            score, matched_on = match_score(a, b)
+            if score < SUGGESTION_THRESHOLD:
+                continue
+            operations.append(_suggestion_update(a, b, score, matched_on, now))
+            if len(operations) >= DEDUPE_BATCH_SIZE:
+                await db.customer_merge_suggestions.bulk_write(operations, ordered=False)
+                operations = []
+    if operations:
+        await db.customer_merge_suggestions.bulk_write(operations, ordered=False)
+    return compared
+
+
+async def scan_duplicates(db) -> dict:
+    """Find candidate blocks in the dedupe_keys index and store merge suggestions for similar pairs.
+
+    Blocks are counted first and only their keys are kept, so a generic key shared by thousands of
+    customers (a placeholder phone, a large company's domain) is dropped by its size instead of
+    having every member pushed into one group. Members of the remaining blocks are then read in
+    batches of keys through the index.
+    """
+    backfilled = await backfill_dedupe_fields(db)
+    now = datetime.now(timezone.utc).isoformat()
+
+    pipeline = [
+        {"$unwind": "$dedupe_keys"},
+        {"$group": {"_id": "$dedupe_keys", "size": {"$sum": 1}}},
+        {"$match": {"size": {"$gt": 1, "$lte": MAX_BLOCK_SIZE}}},
+    ]
+    cursor = db.customers.aggregate(pipeline, allowDiskUse=True)
+
+    blocks = 0
+    compared = 0
+    keys = []
+    async for block in cursor:
+        blocks += 1
+        keys.append(block['_id'])
+        if len(keys) >= BLOCK_KEYS_PER_BATCH:
+            compared += await _compare_blocks(db, keys, now)
+            keys = []
+    if keys:
+        compared += await _compare_blocks(db, keys, now)
+
+    suggestions = await db.customer_merge_suggestions.count_documents({"status": "open"})
+    return {"backfilled": backfilled, "blocks": blocks, "compared": compared, "suggestions": suggestions}
+
+
+class DuplicateScanJob:
+    """Runs the duplicate scan periodically, or on request, in the background under a lease"""
+
+    def __init__(self, db, interval_seconds: float = 86400, lease_seconds: float = 3600):
+        self.db = db
+        self.interval_seconds = interval_seconds
+        self.lease_seconds = lease_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._requested: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._requested):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._requested = None
+
+    async def _run_forever(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Duplicate scan failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    def request(self) -> None:
+        """Start a scan in the background unless this process is already running one"""
+        if self._requested is None or self._requested.done():
+            self._requested = asyncio.create_task(self._run_logged())
+
+    async def _run_logged(self) -> None:
+        try:
+            await self.run()
+        except Exception:
+            logger.exception("Duplicate scan failed")
+
+    async def run(self) -> Optional[dict]:
+        """Scan once and record the summary on the job, or return None if another scan holds the lease"""
+        started_at = datetime.now(timezone.utc)
+        if await acquire_lease(self.db, JOB_NAME, started_at, self.lease_seconds) is None:
+            return None
+
+        result = None
+        try:
+            result = await scan_duplicates(self.db)
+        finally:
+            release = {"$unset": {"locked_until": ""}}
+            if result is not None:
+                finished_at = datetime.now(timezone.utc)
+                release["$set"] = {"last_result": {
+                    **result,
+                    "started_at": started_at.isoformat(),
+                    "finished_at": finished_at.isoformat(),
+                }}
+            await self.db.jobs.update_one({"name": JOB_NAME}, release)
+
+        logger.info("Duplicate scan compared %d pairs in %d blocks", result['compared'], result['blocks'])
+        return result
+
+    async def status(self) -> dict:
+        """Whether any process is scanning now, and the summary of the last finished scan"""
+        return await job_status(self.db, JOB_NAME)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Seconds between keepalive comments on an idle stream; also how often disconnects are noticed
+HEARTBEAT_SECONDS = 15.0
+
+# Browsers wait this long before reconnecting a dropped stream
+RETRY_MILLISECONDS = 3000
+
+# Recent events kept so a reconnecting stream can catch up from its Last-Event-ID
+HISTORY_SIZE = 1000
+
+
+class Subscription:
+    """One open stream's queue of pending events; None in the queue means the stream must end"""
+
+    def __init__(self, owner_id: Optional[str], max_queue_size: int):
+        self.owner_id = owner_id
+        self.evicted = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event; raises asyncio.TimeoutError when none arrives in time"""
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    def offer(self, event: dict) -> bool:
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def close(self) -> None:
+        # Drop whatever is pending so the end marker always fits
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+
+class EventBroker:
+    """In-process fan-out of small change events to open streams, scoped by owner.
+
+    Admin streams subscribe with owner_id None and see every owner's events. Each stream has a
+    bounded queue; a stream that falls that far behind is evicted rather than slowing down the
+    writers or buffering without limit, and its client reconnects and refetches.
+
+    Event ids are "<broker instance>-<sequence>". A new stream starts with a hello event carrying the
+    id it starts after, which clients compare with the id their snapshot was tagged with. A stream
+    resuming from an id this broker can still replay gets the events it missed; otherwise (another
+    worker, a restart, events published while nobody listened) it gets stats.stale and the client
+    reloads.
+    """
+
+    def __init__(self, max_queue_size: int = 100, history_size: int = HISTORY_SIZE):
+        self.max_queue_size = max_queue_size
+        self.instance = uuid.uuid4().hex[:8]
+        self.published = 0
+        self.evicted = 0
+        self._sequence = 0
+        self._history: deque = deque(maxlen=history_size)
+        self._subscriptions: Dict[Optional[str], Set[Subscription]] = {}
+
+    def subscribe(self, owner_id: Optional[str], last_event_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(owner_id, self.max_queue_size)
+        if last_event_id:
+            missed = self._missed(owner_id, last_event_id)
+            if missed is None or len(missed) >= self.max_queue_size:
+                missed = [{"id": self.last_event_id, "type": "stats.stale", "data": {}}]
+            for event in missed:
+                subscription.offer(event)
+        else:
+            subscription.offer({"id": self.last_event_id, "type": "hello", "data": {}})
+        self._subscriptions.setdefault(owner_id, set()).add(subscription)
+        return subscription
+
+    def _event_id(self, sequence: int) -> str:
+        return f"{self.instance}-{sequence}"
+
+    @property
+    def last_event_id(self) -> str:
+        """Id of the latest event published, whether or not anyone received it"""
+        return self._event_id(self._sequence)
+
+    def changed_since(self, owner_id: Optional[str], event_id: str) -> bool:
+        """Whether owner_id's streams may have been sent events after event_id"""
+        if event_id == self.last_event_id:
+            return False
+        missed = self._missed(owner_id, event_id)
+        return missed is None or bool(missed)
+
+    def _missed(self, owner_id: Optional[str], last_event_id: str) -> Optional[List[dict]]:
+        """Events owner_id's streams were sent after last_event_id, or None if they cannot all be replayed"""
+        instance, _, sequence = last_event_id.partition("-")
+        if instance != self.instance or not sequence.isdigit() or int(sequence) > self._sequence:
+            return None
+        sequence = int(sequence)
+        if sequence == self._sequence:
+            return []
+        if not self._history or self._history[0][0] > sequence + 1:
+            return None
+        return [
+            event for event_sequence, event_owner_id, event in self._history
+            if event_sequence > sequence and (owner_id is None or event_owner_id in (None, owner_id))
+        ]
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.owner_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.owner_id]
+
+    def publish(self, owner_id: Optional[str], event_type: str, data: dict) -> None:
+        """Send an event to owner_id's streams and every admin stream; owner_id None reaches all streams"""
+        self._sequence += 1
+        if not self._subscriptions:
+            # Callers may skip work when nobody listens, so this event cannot be replayed later
+            self._history.clear()
+            return
+        self.published += 1
+        event = {"id": self._event_id(self._sequence), "type": event_type, "data": data}
+        self._history.append((self._sequence, owner_id, event))
+
+        if owner_id is None:
+            targets = [subscription for subscriptions in self._subscriptions.values() for subscription in subscriptions]
+        else:
+            targets = list(self._subscriptions.get(owner_id, ())) + list(self._subscriptions.get(None, ()))
+        for subscription in targets:
+            if not subscription.offer(event):
+                self._evict(subscription)
+
+    def _evict(self, subscription: Subscription) -> None:
+        self.evicted += 1
+        subscription.evicted = True
+        self.unsubscribe(subscription)
+        subscription.close()
+        logger.warning("Evicted slow event stream subscriber (%d evicted so far)", self.evicted)
+
+    def close(self) -> None:
+        """End every open stream, e.g. on shutdown"""
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                self.unsubscribe(subscription)
+                subscription.close()
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+def format_event(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+
+async def stream_events(request, broker: EventBroker, subscription: Subscription):
+    """Server-sent events body for one subscription, with keepalives while idle"""
+    try:
+        yield f"retry: {RETRY_MILLISECONDS}\n\n"
+        while True:
+            try:
+                event = await subscription.get(HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                if subscription.evicted:
+                    yield "event: evicted\ndata: {}\n\n"
+                break
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
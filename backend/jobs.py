@@ -0,0 +1,66 @@
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+# Documents read and updated per round trip when filling in new fields
+BACKFILL_BATCH_SIZE = 1000
+
+
+async def acquire_lease(db, name: str, now: datetime, lease_seconds: float) -> Optional[dict]:
+    """Take a background job's lease so only one worker process runs it at a time; returns the job state"""
+    try:
+        return await db.jobs.find_one_and_update(
+            {"name": name, "$or": [
+                {"locked_until": {"$exists": False}},
+                {"locked_until": {"$lt": now.isoformat()}},
+            ]},
+            {"$set": {"locked_until": (now + timedelta(seconds=lease_seconds)).isoformat()}},
+            upsert=True,
+        ) or {}
+    except DuplicateKeyError:
+        return None
+
+
+
+async def renew_lease(db, name: str, lease_seconds: float) -> None:
+    """Push back a held lease so a long run keeps it; a lease already released stays released"""
+    now = datetime.now(timezone.utc)
+    await db.jobs.update_one(
+        {"name": name, "locked_until": {"$exists": True}},
+        {"$set": {"locked_until": (now + timedelta(seconds=lease_seconds)).isoformat()}},
+    )
+
+
+async def job_status(db, name: str) -> dict:
+    """Whether any process holds the job's lease now, and the summary of its last finished run"""
+    state = await db.jobs.find_one({"name": name}, {"_id": 0}) or {}
+    locked_until = state.get('locked_until')
+    return {
+        "running": bool(locked_until) and locked_until > datetime.now(timezone.utc).isoformat(),
+        "last_run": state.get('last_result'),
+    }
+
+
+async def backfill(
+    collection,
+    query: dict,
+    projection: dict,
+    build_operations: Callable[[List[dict]], Awaitable[list]],
+    batch_size: int = BACKFILL_BATCH_SIZE,
+) -> int:
+    """Bulk-write the operations built for each batch of documents matching query; returns how many were written.
+
+    query should stop matching a document once its operation is applied, e.g. {"field": {"$exists": False}}.
+    """
+    cursor = collection.find(query, {"_id": 0, **projection}).batch_size(batch_size)
+    updated = 0
+    while True:
+        batch = await cursor.to_list(length=batch_size)
+        if not batch:
+            break
+        operations = await build_operations(batch)
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    return updated
@@ -0,0 +1,260 @@
+from pydantic import BaseModel, Field, EmailStr
+from typing import List, Optional
+import uuid
+from datetime import datetime, timezone
+from enum import Enum
+
+# Enums
+class UserRole(str, Enum):
+    ADMIN = "admin"
+    USER = "user"
+
+class LeadStatus(str, Enum):
+    NEW = "New"
+    CONTACTED = "Contacted"
+    CONVERTED = "Converted"
+    LOST = "Lost"
+
+class ActivityAction(str, Enum):
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+
+class ProfileFormat(str, Enum):
+    PSTATS = "pstats"
+    COLLAPSED = "collapsed"
+
+class LeadSortField(str, Enum):
+    CREATED_AT = "created_at"
+    SCORE = "score"
+
+# Models
+class User(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    email: EmailStr
+    role: UserRole = UserRole.USER
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class UserCreate(BaseModel):
+    name: str
+    email: EmailStr
+    password: str
+    role: UserRole = UserRole.USER
+
+class UserLogin(BaseModel):
+    email: EmailStr
+    password: str
+
+class Customer(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    email: EmailStr
+    phone: str
+    company: str
+    owner_id: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class CustomerCreate(BaseModel):
+    name: str
+    email: EmailStr
+    phone: str
+    company: str
+
+class CustomerUpdate(BaseModel):
+    name: Optional[str] = None
+    email: Optional[EmailStr] = None
+    phone: Optional[str] = None
+    company: Optional[str] = None
+
+class CustomerSuggestion(BaseModel):
+    id: str
+    name: str
+    company: str
+
+class StatusChange(BaseModel):
+    status: LeadStatus
+    changed_at: datetime
+
+class Lead(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    customer_id: str
+    title: str
+    description: str
+    status: LeadStatus = LeadStatus.NEW
+    value: float
+    status_history: List[StatusChange] = []
+    score: Optional[float] = None
+    scored_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+
+class LeadBoardColumn(BaseModel):
+    status: LeadStatus
+    # Only on first pages; pages continued from a cursor leave them out
+    count: Optional[int] = None
+    total_value: Optional[float] = None
+    leads: List[Lead]
+    next_cursor: Optional[str] = None
+
+class LeadBoard(BaseModel):
+    columns: List[LeadBoardColumn]
+
+class LeadCreate(BaseModel):
+    title: str
+    description: str
+    status: LeadStatus = LeadStatus.NEW
+    value: float
+
+class LeadUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[LeadStatus] = None
+    value: Optional[float] = None
+
+class ScoringRun(BaseModel):
+    mode: str
+    scored: int
+    started_at: datetime
+    finished_at: datetime
+
+class ScoringStatus(BaseModel):
+    running: bool
+    last_run: Optional[ScoringRun] = None
+
+class ArchiveRun(BaseModel):
+    archived: int
+    started_at: datetime
+    finished_at: datetime
+
+class MergeSuggestion(BaseModel):
+    pair_id: str
+    customer_ids: List[str]
+    owner_ids: List[str] = []
+    score: float
+    matched_on: List[str] = []
+    status: str = "open"
+    created_at: datetime
+    updated_at: datetime
+
+class DuplicateScan(BaseModel):
+    backfilled: int
+    blocks: int
+    compared: int
+    suggestions: int
+
+class DuplicateScanRun(DuplicateScan):
+    started_at: datetime
+    finished_at: datetime
+
+class DuplicateScanStatus(BaseModel):
+    running: bool
+    last_run: Optional[DuplicateScanRun] = None
+
+class ActivityEvent(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    entity_type: str
+    entity_id: str
+    customer_id: str
+    owner_id: Optional[str] = None
+    actor_id: str
+    action: ActivityAction
+    changes: dict = {}
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class WebhookCreate(BaseModel):
+    url: str
+    event_types: List[str] = []
+
+class Webhook(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    url: str
+    event_types: List[str] = []
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class RequestProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    query: str = ""
+    user_id: Optional[str] = None
+    trigger: str
+    status_code: int
+    breakdown: dict
+    # Breakdown keys covering everything on the event loop, shared with overlapping_requests other requests
+    loop_wide: List[str] = []
+    overlapping_requests: int = 0
+    # The profiler stopped at its time limit before the response finished
+    truncated: bool = False
+    mongo_commands: dict = {}
+    top_functions: List[dict] = []
+    created_at: datetime
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+    user: User
+
+class DashboardStats(BaseModel):
+    total_customers: int
+    total_leads: int
+    leads_by_status: dict
+    total_value: float
+    # Last event stream id these numbers reflect, for live clients to apply only later deltas
+    event_id: Optional[str] = None
+
+class CoalescingStats(BaseModel):
+    route: str
+    calls: int
+    executions: int
+    coalesced: int
+    reused: int
+    coalescing_ratio: float
+
+class StreamToken(BaseModel):
+    token: str
+    expires_in: int
+
+class EventStreamStats(BaseModel):
+    subscribers: int
+    published: int
+    evicted: int
+
+class OwnerConversion(BaseModel):
+    owner_id: str
+    owner_name: Optional[str] = None
+    total_leads: int
+    converted: int
+    lost: int
+    conversion_rate: float
+
+class CompanyConversion(BaseModel):
+    company: str
+    total_leads: int
+    converted: int
+    lost: int
+    conversion_rate: float
+
+class ValueBandWinRate(BaseModel):
+    band: str
+    min_value: float
+    max_value: Optional[float] = None
+    total_leads: int
+    closed: int
+    converted: int
+    win_rate: float
+
+class PipelineForecast(BaseModel):
+    open_value: float
+    weighted_value: float
+    by_status: dict
+
+class PipelineAnalytics(BaseModel):
+    total_leads: int
+    total_value: float
+    value_percentiles: dict
+    conversion_by_owner: List[OwnerConversion]
+    conversion_by_company: List[CompanyConversion]
+    win_rate_by_value_band: List[ValueBandWinRate]
+    forecast: PipelineForecast
+    generated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
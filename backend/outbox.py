@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+# Without transactions, events are staged on the written document under this field and relayed from there
+PENDING_EVENTS_FIELD = "pending_events"
+
+
+def new_event(event_type: str, aggregate_id: str, owner_id: Optional[str], payload: dict) -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": str(uuid.uuid4()),
+        "type": event_type,
+        "aggregate_id": aggregate_id,
+        "owner_id": owner_id,
+        "payload": payload,
+        "status": PENDING,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+
+
+async def enqueue_event(db, event: dict, session=None) -> None:
+    """Record an event in the outbox; pass the session of the write it belongs to so both commit together"""
+    await db.outbox.insert_one(event, session=session)
+
+
+def stage_event(update: dict, event: dict) -> dict:
+    """Add event to a document update so it is written atomically with it, for the dispatcher to relay.
+
+    Used when multi-document transactions are off: a single-document write is atomic on its own, so
+    the event cannot be lost between the write and a separate outbox insert.
+    """
+    update.setdefault("$push", {})[PENDING_EVENTS_FIELD] = event
+    return update
+
+
+async def relay_events(db, events: List[dict]) -> None:
+    """Move staged events into the outbox; upserts make relaying the same event twice harmless"""
+    if events:
+        await db.outbox.bulk_write(
+            [UpdateOne({"id": event['id']}, {"$setOnInsert": event}, upsert=True) for event in events],
+            ordered=False,
+        )
+
+
+async def delete_relaying_events(db, collection, query: dict) -> int:
+    """Delete documents matching query without losing the events still staged on them; returns how many had some"""
+    await collection.delete_many({**query, f"{PENDING_EVENTS_FIELD}.id": {"$exists": False}})
+    # The few left have staged events, so each is removed and relayed on its own
+    relayed = 0
+    while True:
+        document = await collection.find_one_and_delete(query, {"_id": 0, "id": 1, PENDING_EVENTS_FIELD: 1})
+        if document is None:
+            return relayed
+        await relay_events(db, document.get(PENDING_EVENTS_FIELD, []))
+        relayed += 1
+
+
+class OutboxDispatcher:
+    """Delivers pending outbox events to webhook subscribers in batches, retrying with exponential backoff.
+
+    Events staged on documents in relay_collections are first moved into the outbox. Delivery is at
+    least once, so subscribers should ignore event ids they have already seen. An event whose type no
+    subscriber wants when it is first dispatched is marked delivered with no targets; subscribers added
+    later only receive events written after them.
+    """
+
+    def __init__(
+        self,
+        db,
+        webhook_urls: Optional[List[str]] = None,
+        batch_size: int = 100,
+        poll_interval_seconds: float = 2.0,
+        max_attempts: int = 10,
+        base_backoff_seconds: float = 2.0,
+        max_backoff_seconds: float = 600.0,
+        request_timeout_seconds: float = 10.0,
+        max_connections: int = 20,
+        claim_seconds: float = 60.0,
+        relay_collections: Optional[List[str]] = None,
+    ):
+        self.db = db
+        self.webhook_urls = webhook_urls or []
+        self.batch_size = batch_size
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.request_timeout_seconds = request_timeout_seconds
+        self.max_connections = max_connections
+        self.claim_seconds = claim_seconds
+        self.relay_collections = relay_collections or []
+        self._http: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._http = httpx.AsyncClient(
+                timeout=self.request_timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def notify(self) -> None:
+        """Wake the dispatcher so a freshly written event goes out without waiting for the next poll"""
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                while not self._stopping and await self.relay_batch() >= self.batch_size:
+                    pass
+                # Keep going while full batches are coming back
+                while not self._stopping and await self.dispatch_batch() >= self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def relay_batch(self) -> int:
+        """Move one batch of staged events from documents into the outbox; returns how many documents had some"""
+        relayed = 0
+        for name in self.relay_collections:
+            collection = self.db[name]
+            documents = await collection.find(
+                {f"{PENDING_EVENTS_FIELD}.id": {"$exists": True}},
+                {"_id": 0, "id": 1, PENDING_EVENTS_FIELD: 1},
+            ).limit(self.batch_size).to_list(length=None)
+            if not documents:
+                continue
+
+            # Upserts make a relay that was interrupted before the pull safe to repeat
+            await relay_events(self.db, [event for document in documents for event in document[PENDING_EVENTS_FIELD]])
+            await collection.bulk_write([
+                UpdateOne(
+                    {"id": document['id']},
+                    {"$pull": {PENDING_EVENTS_FIELD: {"id": {"$in": [event['id'] for event in document[PENDING_EVENTS_FIELD]]}}}},
+                )
+                for document in documents
+            ], ordered=False)
+            relayed += len(documents)
+        return relayed
+
+    async def _subscriptions(self) -> List[dict]:
+        subscriptions = [{"url": url, "event_types": []} for url in self.webhook_urls]
+        subscriptions += await self.db.webhooks.find({}, {"_id": 0, "url": 1, "event_types": 1}).to_list(length=None)
+        return subscriptions
+
+    async def _claim(self, now: datetime) -> List[dict]:
+        """Claim a batch of due events so concurrent dispatchers never send the same batch"""
+        claim = str(uuid.uuid4())
+        due = await self.db.outbox.find(
+            {"status": PENDING, "next_attempt_at": {"$lte": now.isoformat()}},
+            {"_id": 0, "id": 1},
+        ).sort("next_attempt_at", 1).limit(self.batch_size).to_list(length=None)
+        if not due:
+            return []
+
+        await self.db.outbox.update_many(
+            {"id": {"$in": [event['id'] for event in due]}, "status": PENDING,
+             "next_attempt_at": {"$lte": now.isoformat()}},
+            {"$set": {
+                "claim": claim,
+                "next_attempt_at": (now + timedelta(seconds=self.claim_seconds)).isoformat(),
+            }},
+        )
+        return await self.db.outbox.find({"claim": claim}, {"_id": 0}).to_list(length=None)
+
+    async def _post(self, url: str, events: List[dict]) -> bool:
+        body = {"events": [
+            {key: event[key] for key in ("id", "type", "aggregate_id", "payload", "created_at")}
+            for event in events
+        ]}
+        try:
+            response = await self._http.post(url, json=body)
+        except httpx.HTTPError as error:
+            logger.warning("Webhook delivery to %s failed: %s", url, error)
+            return False
+        if response.status_code >= 300:
+            logger.warning("Webhook delivery to %s returned %d", url, response.status_code)
+            return False
+        return True
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.base_backoff_seconds * (2 ** (attempts - 1)), self.max_backoff_seconds)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def dispatch_batch(self) -> int:
+        """Deliver one batch of due events; returns how many events were claimed"""
+        now = datetime.now(timezone.utc)
+        events = await self._claim(now)
+        if not events:
+            return 0
+
+        subscriptions = await self._subscriptions()
+        # Each event remembers the subscribers still owed a delivery so retries skip the ones that succeeded
+        by_url: Dict[str, List[dict]] = {}
+        for event in events:
+            if 'targets' not in event:
+                event['targets'] = sorted({
+                    subscription['url'] for subscription in subscriptions
+                    if not subscription.get('event_types') or event['type'] in subscription['event_types']
+                })
+            for url in event['targets']:
+                by_url.setdefault(url, []).append(event)
+
+        urls = list(by_url)
+        results = await asyncio.gather(*(self._post(url, by_url[url]) for url in urls))
+        delivered_urls = {url for url, ok in zip(urls, results) if ok}
+
+        finished_at = datetime.now(timezone.utc)
+        operations = []
+        for event in events:
+            # No targets means no subscriber wants this type; it counts as delivered rather than waiting forever
+            remaining = [url for url in event['targets'] if url not in delivered_urls]
+            update = {"targets": remaining}
+            if not remaining:
+                update.update(status=DELIVERED, delivered_at=finished_at.isoformat())
+            else:
+                attempts = event.get('attempts', 0) + 1
+                update['attempts'] = attempts
+                if attempts >= self.max_attempts:
+                    update['status'] = FAILED
+                else:
+                    update['next_attempt_at'] = (finished_at + timedelta(seconds=self._backoff(attempts))).isoformat()
+            operations.append(UpdateOne({"id": event['id']}, {"$set": update, "$unset": {"claim": ""}}))
+        await self.db.outbox.bulk_write(operations, ordered=False)
+        return len(events)
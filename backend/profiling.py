@@ -0,0 +1,175 @@
+import asyncio
+import cProfile
+import marshal
+import pstats
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from pymongo import monitoring
+
+# Functions whose cumulative time makes up each bucket of the breakdown, as (file suffix, function name).
+# cProfile sees every task on the event loop, so these buckets also hold the work of other requests and
+# background jobs that ran while the profile was open; only total_ms and mongo_ms are the request's own.
+BREAKDOWN_FUNCTIONS = {
+    "parse_from_mongo": [("server.py", "parse_from_mongo")],
+    "pydantic_validation": [("pydantic/main.py", "__init__"), ("fastapi/_compat.py", "validate")],
+    "json_encoding": [("fastapi/encoders.py", "jsonable_encoder"), ("starlette/responses.py", "render")],
+}
+
+# Breakdown keys measured by cProfile rather than for the request alone
+LOOP_WIDE_KEYS = [f"{bucket}_ms" for bucket in BREAKDOWN_FUNCTIONS] + ["other_ms"]
+
+TOP_FUNCTIONS = 25
+
+# Frames deeper than this are folded into their parent in collapsed stacks
+MAX_STACK_DEPTH = 64
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+# cProfile hooks the whole thread, so only one request is profiled at a time
+_profiler_lock = threading.Lock()
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Adds the duration of every Mongo command to the profile of the request that issued it"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.add_mongo(event.command_name, event.duration_micros)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+class RequestProfile:
+    """cProfile run plus Mongo command timings for a single request, cut off after max_seconds"""
+
+    def __init__(self, max_seconds: float = 30.0):
+        self.max_seconds = max_seconds
+        self.mongo_micros = 0
+        self.mongo_commands: Dict[str, int] = {}
+        self.stats: Optional[pstats.Stats] = None
+        self.wall_seconds = 0.0
+        self.truncated = False
+        self._finished = False
+        self._lock = threading.Lock()
+        self._profiler = cProfile.Profile()
+
+    def add_mongo(self, command_name: str, duration_micros: int) -> None:
+        # Motor runs commands on executor threads
+        with self._lock:
+            if self._finished:
+                return
+            self.mongo_micros += duration_micros
+            self.mongo_commands[command_name] = self.mongo_commands.get(command_name, 0) + 1
+
+    def start(self) -> bool:
+        """Begin profiling the current context; False if another request already holds the profiler"""
+        if not _profiler_lock.acquire(blocking=False):
+            return False
+        self._token = _current_profile.set(self)
+        self._started = time.perf_counter()
+        self._profiler.enable()
+        # A slow or long-lived response must not keep every other request from being profiled
+        self._deadline = asyncio.get_running_loop().call_later(self.max_seconds, self._finish, True)
+        return True
+
+    def _finish(self, truncated: bool = False) -> None:
+        if self._finished:
+            return
+        self._profiler.disable()
+        with self._lock:
+            self._finished = True
+        self.truncated = truncated
+        self.wall_seconds = time.perf_counter() - self._started
+        _profiler_lock.release()
+
+    def stop(self) -> None:
+        self._deadline.cancel()
+        self._finish()
+        _current_profile.reset(self._token)
+        self.stats = pstats.Stats(self._profiler)
+
+    def _cumulative(self, targets: List[tuple]) -> float:
+        total = 0.0
+        for (filename, _, function), (_, _, _, cumulative, _) in self.stats.stats.items():
+            if any(filename.endswith(suffix) and function == name for suffix, name in targets):
+                total += cumulative
+        return total
+
+    def breakdown(self) -> dict:
+        """Milliseconds spent per bucket; everything unaccounted for lands in other_ms"""
+        result = {"total_ms": self.wall_seconds * 1000, "mongo_ms": self.mongo_micros / 1000}
+        for bucket, targets in BREAKDOWN_FUNCTIONS.items():
+            result[f"{bucket}_ms"] = self._cumulative(targets) * 1000
+        result['other_ms'] = max(result['total_ms'] - sum(
+            value for key, value in result.items() if key != 'total_ms'
+        ), 0.0)
+        return {key: round(value, 3) for key, value in result.items()}
+
+    def top_functions(self, limit: int = TOP_FUNCTIONS) -> List[dict]:
+        rows = sorted(self.stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [
+            {
+                "function": pstats.func_std_string(func),
+                "calls": calls,
+                "self_ms": round(own * 1000, 3),
+                "cumulative_ms": round(cumulative * 1000, 3),
+            }
+            for func, (_, calls, own, cumulative, _) in rows
+        ]
+
+    def dump(self) -> bytes:
+        """Stats in the format written by pstats.Stats.dump_stats, loadable by snakeviz and flameprof"""
+        return marshal.dumps(self.stats.stats)
+
+
+def collapsed_stacks(raw_stats: bytes) -> str:
+    """Convert dumped stats into collapsed "a;b;c micros" lines for flamegraph.pl or speedscope.
+
+    cProfile only records caller/callee pairs, so each function's time is split across its
+    call paths in proportion to the time each caller spent in it.
+    """
+    stats = marshal.loads(raw_stats)
+    children: Dict[tuple, List[tuple]] = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    def label(func: tuple) -> str:
+        filename, line, name = func
+        return f"{name} ({filename.rsplit('/', 1)[-1]}:{line})"
+
+    lines: Dict[str, float] = {}
+
+    def walk(func: tuple, path: List[str], on_path: set, share: float) -> None:
+        _, _, own, cumulative, _ = stats[func]
+        path = path + [label(func)]
+        stack = ";".join(path)
+        lines[stack] = lines.get(stack, 0.0) + own * share
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for child, edge_cumulative in children.get(func, []):
+            if child in on_path or not stats[child][3]:
+                continue
+            child_share = share * edge_cumulative / stats[child][3]
+            # Paths carrying less than a microsecond would not show up in the graph
+            if child_share * stats[child][3] < 1e-6:
+                continue
+            walk(child, path, on_path | {child}, child_share)
+
+    roots = [func for func, (_, _, _, _, callers) in stats.items() if not callers]
+    for root in roots:
+        walk(root, [], {root}, 1.0)
+
+    return "\n".join(
+        f"{stack} {int(seconds * 1_000_000)}"
+        for stack, seconds in lines.items()
+        if seconds * 1_000_000 >= 1
+    ) + "\n"
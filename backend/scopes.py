@@ -0,0 +1,39 @@
+from abc import ABC, abstractmethod
+from typing import Hashable, List, Optional
+
+
+class OwnerScoped(ABC):
+    """Base for in-process read caches kept per owner scope and dropped when that owner's data changes.
+
+    A scope is an owner id, or ALL_OWNERS for admin reads that span every owner. A write to one
+    owner's data affects that owner's scope and the ALL_OWNERS scope; a write without an owner
+    affects every scope. Subclasses list their entry dicts in _scoped_entries and, when keys are
+    not scopes themselves, say where the scope is in _scope_of.
+    """
+
+    ALL_OWNERS = '*'
+
+    def __init__(self):
+        # Bumped on every invalidation so results computed across a write are not stored
+        self.generation = 0
+
+    def scope(self, owner_id: Optional[str]) -> str:
+        return owner_id or self.ALL_OWNERS
+
+    @abstractmethod
+    def _scoped_entries(self) -> List[dict]:
+        """The dicts holding this cache's entries"""
+
+    def _scope_of(self, key: Hashable) -> Hashable:
+        return key
+
+    def invalidate(self, owner_id: Optional[str] = None) -> None:
+        """Drop entries a write to owner_id's data may have changed; None drops everything"""
+        self.generation += 1
+        for entries in self._scoped_entries():
+            if owner_id is None:
+                entries.clear()
+                continue
+            scopes = {owner_id, self.ALL_OWNERS}
+            for key in [key for key in entries if self._scope_of(key) in scopes]:
+                del entries[key]
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+from jobs import acquire_lease, job_status, renew_lease
+from models import LeadStatus
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "lead_scoring"
+
+# Workers start from a fresh interpreter rather than forking a process that already runs Motor and pymongo threads
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Leads are streamed and scored in chunks of this many documents
+SCORING_CHUNK_SIZE = 2000
+
+# Logistic model weights; inputs are described in score_chunk
+INTERCEPT = -1.2
+WEIGHT_LOG_VALUE = -0.08
+WEIGHT_AGE_DAYS = -0.015
+WEIGHT_CONTACTED = 0.9
+WEIGHT_TRANSITIONS = 0.15
+WEIGHT_CUSTOMER_RATE = 2.5
+
+# Beta prior applied to each customer's conversion rate so customers with few closed leads sit near the mean
+PRIOR_CONVERTED = 1.0
+PRIOR_CLOSED = 4.0
+
+LEAD_FEATURES_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "customer_id": 1,
+    "status": 1,
+    "value": 1,
+    "created_at": 1,
+    "transitions": {"$max": [{"$subtract": [{"$size": {"$ifNull": ["$status_history", []]}}, 1]}, 0]},
+    "contacted": {"$in": [LeadStatus.CONTACTED.value, {"$ifNull": ["$status_history.status", []]}]},
+}
+
+
+def score_chunk(chunk: Dict[str, np.ndarray], now_ts: float) -> np.ndarray:
+    """Score a chunk of leads given as column arrays; runs inside a worker process"""
+    values = np.nan_to_num(chunk['value'].astype(np.float64))
+    created = pd.to_datetime(pd.Series(chunk['created_at']), utc=True, errors='coerce', format='ISO8601')
+    created_ts = (created - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+    age_days = np.clip(np.nan_to_num((now_ts - created_ts) / 86400.0), 0, None)
+    statuses = chunk['status']
+    contacted = chunk['contacted'].astype(bool) | (statuses == LeadStatus.CONTACTED.value)
+
+    z = (
+        INTERCEPT
+        + WEIGHT_LOG_VALUE * np.log1p(np.clip(values, 0, None))
+        + WEIGHT_AGE_DAYS * age_days
+        + WEIGHT_CONTACTED * contacted
+        + WEIGHT_TRANSITIONS * chunk['transitions'].astype(np.float64)
+        + WEIGHT_CUSTOMER_RATE * chunk['customer_rate'].astype(np.float64)
+    )
+    scores = 1.0 / (1.0 + np.exp(-z))
+
+    # Closed leads have a known outcome
+    scores[statuses == LeadStatus.CONVERTED.value] = 1.0
+    scores[statuses == LeadStatus.LOST.value] = 0.0
+    return np.round(scores, 4)
+
+
+async def customer_conversion_rates(db, customer_ids: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """Smoothed share of closed leads that converted, per customer"""
+    match = {"status": {"$in": [LeadStatus.CONVERTED.value, LeadStatus.LOST.value]}}
+    if customer_ids is not None:
+        match['customer_id'] = {"$in": list(customer_ids)}
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$customer_id",
+            "closed": {"$sum": 1},
+            "converted": {"$sum": {"$cond": [{"$eq": ["$status", LeadStatus.CONVERTED.value]}, 1, 0]}},
+        }},
+    ]
+    # Archived leads are all closed, so they keep counting towards their customer's history
+    totals: Dict[str, list] = {}
+    for collection in (db.leads, db.leads_archive):
+        for row in await collection.aggregate(pipeline).to_list(length=None):
+            counts = totals.setdefault(row['_id'], [0, 0])
+            counts[0] += row['converted']
+            counts[1] += row['closed']
+    return {
+        customer_id: (converted + PRIOR_CONVERTED) / (closed + PRIOR_CLOSED)
+        for customer_id, (converted, closed) in totals.items()
+    }
+
+
+class LeadScoringJob:
+    """Periodically scores leads in chunks across a process pool and writes scores back in bulk"""
+
+    def __init__(
+        self,
+        db,
+        interval_seconds: float = 900,
+        full_interval_seconds: float = 86400,
+        workers: Optional[int] = None,
+        chunk_size: int = SCORING_CHUNK_SIZE,
+        lease_seconds: float = 600,
+    ):
+        self.db = db
+        self.interval_seconds = interval_seconds
+        self.full_interval_seconds = full_interval_seconds
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._requested: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._requested):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._requested = None
+        if self._pool is not None:
+            # Waiting for the workers to exit blocks, so keep it off the event loop
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+    async def _run_forever(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lead scoring run failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    def request(self, full: bool = False) -> None:
+        """Start a run in the background unless this process is already running a requested one"""
+        if self._requested is None or self._requested.done():
+            self._requested = asyncio.create_task(self._run_logged(full))
+
+    async def _run_logged(self, full: bool) -> None:
+        try:
+            await self.run(full=full)
+        except Exception:
+            logger.exception("Lead scoring run failed")
+
+    async def status(self) -> dict:
+        return await job_status(self.db, JOB_NAME)
+
+    async def run(self, full: bool = False) -> Optional[dict]:
+        """Score changed leads (or all leads when full) and return a run summary, or None if another run holds the lease"""
+        started_at = datetime.now(timezone.utc)
+        state = await acquire_lease(self.db, JOB_NAME, started_at, self.lease_seconds)
+        if state is None:
+            return None
+
+        last_run_at = state.get('last_run_at')
+        last_full_run_at = state.get('last_full_run_at')
+        if last_run_at is None or last_full_run_at is None:
+            full = True
+        elif started_at - datetime.fromisoformat(last_full_run_at) >= timedelta(seconds=self.full_interval_seconds):
+            full = True
+
+        job_update = {"last_run_at": started_at.isoformat()}
+        scored = None
+        try:
+            if full:
+                scored = await self._score(query={}, customer_ids=None, now=started_at)
+                job_update['last_full_run_at'] = started_at.isoformat()
+            else:
+                # A changed lead also shifts its customer's conversion rate, so rescore every lead of that customer
+                customer_ids = await self.db.leads.distinct("customer_id", {"$or": [
+                    {"updated_at": {"$gt": last_run_at}},
+                    {"score": None},
+                ]})
+                scored = await self._score(
+                    query={"customer_id": {"$in": customer_ids}},
+                    customer_ids=customer_ids,
+                    now=started_at,
+                ) if customer_ids else 0
+        finally:
+            # Only advance the watermark when the run completed
+            finished_at = datetime.now(timezone.utc)
+            release = {"$unset": {"locked_until": ""}}
+            if scored is not None:
+                job_update['last_result'] = {
+                    "mode": "full" if full else "incremental",
+                    "scored": scored,
+                    "started_at": started_at.isoformat(),
+                    "finished_at": finished_at.isoformat(),
+                }
+                release["$set"] = job_update
+            await self.db.jobs.update_one({"name": JOB_NAME}, release)
+
+        logger.info("Scored %d leads (%s) in %.2fs", scored, "full" if full else "incremental",
+                    (finished_at - started_at).total_seconds())
+        return {
+            "mode": "full" if full else "incremental",
+            "scored": scored,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+
+    async def _score(self, query: dict, customer_ids: Optional[list], now: datetime) -> int:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(POOL_START_METHOD),
+            )
+
+        rates = await customer_conversion_rates(self.db, customer_ids)
+        default_rate = PRIOR_CONVERTED / PRIOR_CLOSED
+        now_ts = now.timestamp()
+        scored_at = now.isoformat()
+        loop = asyncio.get_running_loop()
+
+        async def score_and_write(frame: pd.DataFrame) -> int:
+            chunk = {
+                'value': pd.to_numeric(frame['value'], errors='coerce').to_numpy(dtype=np.float64),
+                'created_at': frame['created_at'].to_numpy(dtype=object),
+                'status': frame['status'].astype(str).to_numpy(),
+                'contacted': frame['contacted'].fillna(False).to_numpy(dtype=bool),
+                'transitions': frame['transitions'].fillna(0).to_numpy(dtype=np.int64),
+                'customer_rate': frame['customer_id'].map(rates).fillna(default_rate).to_numpy(dtype=np.float64),
+            }
+            scores = await loop.run_in_executor(self._pool, score_chunk, chunk, now_ts)
+            await self.db.leads.bulk_write(
+                [
+                    UpdateOne({"id": lead_id}, {"$set": {"score": float(score), "scored_at": scored_at}})
+                    for lead_id, score in zip(frame['id'], scores)
+                ],
+                ordered=False,
+            )
+            return len(frame)
+
+        columns = [field for field in LEAD_FEATURES_PROJECTION if field != '_id']
+        cursor = self.db.leads.aggregate([{"$match": query}, {"$project": LEAD_FEATURES_PROJECTION}])
+        pending = set()
+        scored = 0
+        try:
+            while True:
+                batch = await cursor.to_list(length=self.chunk_size)
+                if not batch:
+                    break
+                pending.add(asyncio.ensure_future(score_and_write(pd.DataFrame.from_records(batch, columns=columns))))
+                # A full run can outlast one lease, so hold on to it chunk by chunk
+                await renew_lease(self.db, JOB_NAME, self.lease_seconds)
+
+                # Keep every worker busy without buffering the whole collection in memory
+                if len(pending) >= self.workers * 2:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    scored += sum(task.result() for task in done)
+            if pending:
+                scored += sum(await asyncio.gather(*pending))
+        finally:
+            for task in pending:
+                task.cancel()
+        return scored
@@ -1,122 +1,100 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from starlette.datastructures import MutableHeaders, State
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from bson import Binary
+import asyncio
 import logging
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
-import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
-from enum import Enum
+
+from models import (
+    UserRole, LeadStatus, LeadSortField, ActivityAction, ActivityEvent, User, UserCreate, UserLogin,
+    Customer, CustomerCreate, CustomerUpdate, CustomerSuggestion,
+    Lead, LeadCreate, LeadUpdate, LeadBoard, LeadBoardColumn, StatusChange, Token, DashboardStats, CoalescingStats, EventStreamStats, StreamToken,
+    PipelineAnalytics, ScoringStatus, ArchiveRun, MergeSuggestion, DuplicateScanStatus,
+    Webhook, WebhookCreate, ProfileFormat, RequestProfileSummary,
+)
+from analytics import AnalyticsCache, compute_pipeline_analytics
+from scoring import LeadScoringJob
+from archive import LeadArchiveJob, load_leads, apply_lead_update
+from dedupe import customer_dedupe_fields, find_duplicates, suggest_merges, backfill_dedupe_fields, DuplicateScanJob
+from activity import ActivityLog
+from outbox import (
+    OutboxDispatcher, new_event, enqueue_event, stage_event, relay_events, delete_relaying_events, PENDING_EVENTS_FIELD,
+)
+from coalesce import SingleFlight
+from events import EventBroker, stream_events
+from board import lead_board, backfill_lead_owners
+from autocomplete import PrefixCache, autocomplete, customer_search_fields, backfill_search_terms
+from profiling import MongoCommandTimer, RequestProfile, collapsed_stacks, LOOP_WIDE_KEYS
+from settings import Settings
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# The Mongo client, caches, event broker and background workers are built by the app lifespan and kept
+# on app.state; handlers get them through these dependencies and pass them on to helpers
+def get_state(request: Request) -> State:
+    return request.app.state
+
+def get_db(state: State = Depends(get_state)) -> AsyncIOMotorDatabase:
+    return state.db
 
-# Create the main app without a prefix
-app = FastAPI(title="Mini CRM API", version="1.0.0")
+# Browsers may reuse an autocomplete response for this long
+AUTOCOMPLETE_MAX_AGE = 10
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Liveness and readiness probes live outside /api
+health_router = APIRouter()
+
+# How long /readyz waits for a ping before reporting the database unavailable
+READY_PING_TIMEOUT = 2.0
+
+# Dashboard stats are recounted this many times at most to get a snapshot no event landed in the middle of
+STATS_SNAPSHOT_ATTEMPTS = 3
+
+# Admins send this header to have a request profiled
+PROFILE_HEADER = "X-Profile"
+
+# Never profiled: the profiles API itself, and streams that stay open far longer than a request
+UNPROFILED_PATHS = ("/api/profiles", "/api/events/stream")
+
 # JWT Settings
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
+# Event stream tokens travel in the URL, so they only live long enough to open the stream
+STREAM_TOKEN_EXPIRE_SECONDS = 60
+STREAM_TOKEN_AUDIENCE = "events-stream"
 
 # Security
 security = HTTPBearer()
 
-# Enums
-class UserRole(str, Enum):
-    ADMIN = "admin"
-    USER = "user"
-
-class LeadStatus(str, Enum):
-    NEW = "New"
-    CONTACTED = "Contacted"
-    CONVERTED = "Converted"
-    LOST = "Lost"
-
-# Models
-class User(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    email: EmailStr
-    role: UserRole = UserRole.USER
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class UserCreate(BaseModel):
-    name: str
-    email: EmailStr
-    password: str
-    role: UserRole = UserRole.USER
-
-class UserLogin(BaseModel):
-    email: EmailStr
-    password: str
-
-class Customer(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    email: EmailStr
-    phone: str
-    company: str
-    owner_id: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class CustomerCreate(BaseModel):
-    name: str
-    email: EmailStr
-    phone: str
-    company: str
-
-class CustomerUpdate(BaseModel):
-    name: Optional[str] = None
-    email: Optional[EmailStr] = None
-    phone: Optional[str] = None
-    company: Optional[str] = None
-
-class Lead(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    customer_id: str
-    title: str
-    description: str
-    status: LeadStatus = LeadStatus.NEW
-    value: float
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class LeadCreate(BaseModel):
-    title: str
-    description: str
-    status: LeadStatus = LeadStatus.NEW
-    value: float
-
-class LeadUpdate(BaseModel):
-    title: Optional[str] = None
-    description: Optional[str] = None
-    status: Optional[LeadStatus] = None
-    value: Optional[float] = None
-
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-    user: User
-
-class DashboardStats(BaseModel):
-    total_customers: int
-    total_leads: int
-    leads_by_status: dict
-    total_value: float
+# Lead statuses that downstream systems are notified about
+LEAD_STATUS_EVENTS = {
+    LeadStatus.CONVERTED: "lead.converted",
+    LeadStatus.LOST: "lead.lost",
+}
 
 # Utility functions
 def hash_password(password: str) -> str:
@@ -132,10 +110,29 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    return await user_from_token(db, credentials.credentials)
+
+def create_stream_token(user_id: str) -> str:
+    expire = datetime.now(timezone.utc) + timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    return jwt.encode({"sub": user_id, "aud": STREAM_TOKEN_AUDIENCE, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+async def get_stream_user(request: Request, token: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Like get_current_user, but also takes a stream token as a query parameter since EventSource cannot send headers"""
+    scheme, _, header_token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and header_token:
+        return await user_from_token(db, header_token)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return await user_from_token(db, token, audience=STREAM_TOKEN_AUDIENCE)
+
+async def user_from_token(db, token: str, audience: Optional[str] = None) -> User:
+    # Stream tokens carry an audience, so they are rejected everywhere an audience is not asked for
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], audience=audience)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
@@ -159,8 +156,161 @@ def prepare_for_mongo(data):
         for key, value in data.items():
             if isinstance(value, datetime):
                 data[key] = value.isoformat()
+            elif isinstance(value, list):
+                data[key] = [prepare_for_mongo(item) for item in value]
     return data
 
+def invalidate_owner_caches(state: State, owner_id: Optional[str] = None):
+    """Drop cached read results affected by a write to owner_id's customers or leads"""
+    state.analytics_cache.invalidate(owner_id)
+    state.prefix_cache.invalidate(owner_id)
+    state.read_coalescer.invalidate(owner_id)
+
+@asynccontextmanager
+async def write_transaction(state: State):
+    """Yield a session with an open transaction when enabled, otherwise None"""
+    if not state.settings.mongo_transactions:
+        yield None
+        return
+    async with await state.client.start_session() as session:
+        async with session.start_transaction():
+            yield session
+
+def lead_status_event(lead: dict, previous_status: Optional[str], owner_id: Optional[str], current_user: User):
+    """Outbox event for a lead entering a status downstream systems care about, if it did"""
+    status = LeadStatus(lead['status'])
+    event_type = LEAD_STATUS_EVENTS.get(status)
+    if event_type is None or status == previous_status:
+        return None
+    return new_event(event_type, lead['id'], owner_id, {
+        "lead_id": lead['id'],
+        "customer_id": lead['customer_id'],
+        "title": lead['title'],
+        "value": lead['value'],
+        "status": status.value,
+        "previous_status": previous_status,
+        "changed_by": current_user.id,
+        "changed_at": lead['updated_at'],
+    })
+
+def stats_delta(before: Optional[dict] = None, after: Optional[dict] = None, customers: int = 0) -> dict:
+    """How dashboard counters move when a lead goes from before to after; None means absent"""
+    delta = {"total_customers": customers, "total_leads": 0, "leads_by_status": {}, "total_value": 0.0}
+    for lead, sign in ((before, -1), (after, 1)):
+        if lead is None:
+            continue
+        status = LeadStatus(lead['status']).value
+        delta['total_leads'] += sign
+        delta['leads_by_status'][status] = delta['leads_by_status'].get(status, 0) + sign
+        delta['total_value'] += sign * lead.get('value', 0)
+    delta['leads_by_status'] = {status: count for status, count in delta['leads_by_status'].items() if count}
+    return delta
+
+def publish_stats_change(event_broker: EventBroker, owner_id: Optional[str], delta: dict):
+    if delta['total_customers'] or delta['total_leads'] or delta['leads_by_status'] or delta['total_value']:
+        event_broker.publish(owner_id, "stats.changed", delta)
+
+def publish_lead_change(
+    event_broker: EventBroker,
+    event_type: str,
+    lead: dict,
+    owner_id: Optional[str],
+    before: Optional[dict],
+    after: Optional[dict],
+):
+    """Push a lead change and the resulting dashboard counter deltas to open event streams"""
+    event_broker.publish(owner_id, event_type, {
+        "id": lead['id'],
+        "customer_id": lead['customer_id'],
+        "title": lead['title'],
+        "status": LeadStatus(lead['status']).value,
+        "value": lead['value'],
+    })
+    publish_stats_change(event_broker, owner_id, stats_delta(before, after))
+
+def diff_changes(existing: dict, update_data: dict) -> dict:
+    """Fields whose value changed, as {field: {"from": old, "to": new}}"""
+    return {
+        key: {"from": existing.get(key), "to": value}
+        for key, value in update_data.items()
+        if existing.get(key) != value
+    }
+
+async def log_activity(
+    activity_log: ActivityLog,
+    current_user: User,
+    action: ActivityAction,
+    entity_type: str,
+    entity_id: str,
+    customer_id: str,
+    owner_id: Optional[str],
+    changes: Optional[dict] = None,
+):
+    event = ActivityEvent(
+        entity_type=entity_type,
+        entity_id=entity_id,
+        customer_id=customer_id,
+        owner_id=owner_id,
+        actor_id=current_user.id,
+        action=action,
+        changes=changes or {},
+    )
+    await activity_log.record(prepare_for_mongo(event.dict()))
+
+async def get_accessible_lead(db, lead_id: str, current_user: User):
+    """Find a lead, hot or archived, and the owner of its customer, enforcing access for non-admins"""
+    lead = await db.leads.find_one({"id": lead_id})
+    if not lead:
+        lead = await db.leads_archive.find_one({"id": lead_id})
+    if not lead:
+        raise HTTPException(status_code=404, detail="Lead not found")
+    
+    customer = await db.customers.find_one({"id": lead['customer_id']}, {"_id": 0, "owner_id": 1})
+    owner_id = customer['owner_id'] if customer else None
+    
+    # Check if user has access to the customer
+    if current_user.role != UserRole.ADMIN and owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return lead, owner_id
+
+def new_lead(lead_data: dict) -> Lead:
+    """Build a lead with its initial status recorded in the history"""
+    lead = Lead(**lead_data)
+    lead.updated_at = lead.created_at
+    lead.status_history = [StatusChange(status=lead.status, changed_at=lead.created_at)]
+    return lead
+
+def lead_sort_spec(sort: Optional[LeadSortField]):
+    """Translate a lead listing sort option into a Mongo sort specification"""
+    if sort == LeadSortField.SCORE:
+        return [("score", -1), ("created_at", -1)]
+    if sort == LeadSortField.CREATED_AT:
+        return [("created_at", -1)]
+    return None
+
+async def find_leads(db, query: dict, sort: Optional[LeadSortField] = None,
+                     include_archived: bool = False) -> List[dict]:
+    return await load_leads(db, query, lead_sort_spec(sort), include_archived)
+
+def strong_keys_changed(existing_customer: dict, dedupe_fields: dict) -> bool:
+    return any(existing_customer.get(key) != dedupe_fields[key] for key in ('email_key', 'phone_key'))
+
+async def check_duplicate_customer(db, dedupe_fields: dict, current_user: User, allow_duplicate: bool,
+                                   exclude_id: Optional[str] = None) -> List[dict]:
+    """Reject a duplicate of a customer the user can see unless allowed; return every match for merge suggestions.
+
+    Matches under other owners never block the write or name the matching field, so the check
+    can't be used to probe customers the user has no access to.
+    """
+    matches = await find_duplicates(db, dedupe_fields, exclude_id)
+    if not allow_duplicate:
+        for match in matches:
+            if current_user.role == UserRole.ADMIN or match.get('owner_id') == current_user.id:
+                field = "email" if match.get('email_key') == dedupe_fields['email_key'] else "phone"
+                raise HTTPException(status_code=409, detail=f"A customer with this {field} already exists")
+    return matches
+
 def parse_from_mongo(item):
     """Convert ISO strings back to datetime objects"""
     if isinstance(item, dict):
@@ -174,7 +324,7 @@ def parse_from_mongo(item):
 
 # Auth endpoints
 @api_router.post("/auth/register", response_model=Token)
-async def register(user_data: UserCreate):
+async def register(user_data: UserCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     # Check if user exists
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
@@ -199,7 +349,7 @@ async def register(user_data: UserCreate):
     return Token(access_token=access_token, token_type="bearer", user=user)
 
 @api_router.post("/auth/login", response_model=Token)
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, db: AsyncIOMotorDatabase = Depends(get_db)):
     # Find user
     user = await db.users.find_one({"email": user_data.email})
     if not user or not verify_password(user_data.password, user['password_hash']):
@@ -214,13 +364,30 @@ async def login(user_data: UserLogin):
 
 # Customer endpoints
 @api_router.post("/customers", response_model=Customer)
-async def create_customer(customer_data: CustomerCreate, current_user: User = Depends(get_current_user)):
+async def create_customer(
+    customer_data: CustomerCreate, 
+    allow_duplicate: bool = False,
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    state: State = Depends(get_state)
+):
     customer_dict = customer_data.dict()
     customer_dict['owner_id'] = current_user.id
     customer = Customer(**customer_dict)
     
+    # Reject customers the user already has; matches under other owners become merge suggestions
+    dedupe_fields = customer_dedupe_fields(customer_dict)
+    matches = await check_duplicate_customer(db, dedupe_fields, current_user, allow_duplicate)
+    
     customer_mongo = prepare_for_mongo(customer.dict())
+    customer_mongo.update(dedupe_fields)
+    customer_mongo.update(customer_search_fields(customer_dict))
     await db.customers.insert_one(customer_mongo)
+    await suggest_merges(db, customer_mongo, matches)
+    invalidate_owner_caches(state, current_user.id)
+    publish_stats_change(state.event_broker, current_user.id, stats_delta(customers=1))
+    await log_activity(state.activity_log, current_user, ActivityAction.CREATED, "customer", customer.id, customer.id,
+                       current_user.id)
     
     return customer
 
@@ -229,7 +396,8 @@ async def get_customers(
     skip: int = 0, 
     limit: int = 10, 
     search: str = "",
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     query = {}
     if current_user.role != UserRole.ADMIN:
@@ -245,8 +413,51 @@ async def get_customers(
     customers = await db.customers.find(query).skip(skip).limit(limit).to_list(length=None)
     return [Customer(**parse_from_mongo(customer)) for customer in customers]
 
+@api_router.get("/customers/autocomplete", response_model=List[CustomerSuggestion])
+async def autocomplete_customers(
+    request: Request, 
+    response: Response, 
+    q: str = "", 
+    limit: int = 8, 
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    state: State = Depends(get_state)
+):
+    # A superseded keystroke whose client already gave up should not reach Mongo
+    if await request.is_disconnected():
+        return []
+    
+    owner_id = None if current_user.role == UserRole.ADMIN else current_user.id
+    suggestions = await autocomplete(db, state.prefix_cache, owner_id, q, limit)
+    response.headers['Cache-Control'] = f"private, max-age={AUTOCOMPLETE_MAX_AGE}"
+    return suggestions
+
+@api_router.get("/customers/duplicates", response_model=List[MergeSuggestion])
+async def get_duplicate_suggestions(
+    skip: int = 0, 
+    limit: int = 20, 
+    current_user: User = Depends(get_admin_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    suggestions = await db.customer_merge_suggestions.find({"status": "open"}) \
+        .sort("score", -1).skip(skip).limit(limit).to_list(length=None)
+    return [MergeSuggestion(**parse_from_mongo(suggestion)) for suggestion in suggestions]
+
+@api_router.get("/customers/duplicates/scan", response_model=DuplicateScanStatus)
+async def get_duplicate_scan(current_user: User = Depends(get_admin_user), state: State = Depends(get_state)):
+    return DuplicateScanStatus(**await state.duplicate_scan_job.status())
+
+@api_router.post("/customers/duplicates/scan", response_model=DuplicateScanStatus, status_code=202)
+async def scan_duplicate_customers(current_user: User = Depends(get_admin_user), state: State = Depends(get_state)):
+    # Scans take a while on a large customer base, so they run in the background; poll GET for the result
+    state.duplicate_scan_job.request()
+    return DuplicateScanStatus(**await state.duplicate_scan_job.status())
+
 @api_router.get("/customers/{customer_id}", response_model=Customer)
-async def get_customer(customer_id: str, current_user: User = Depends(get_current_user)):
+async def get_customer(
+    customer_id: str, current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
     query = {"id": customer_id}
     if current_user.role != UserRole.ADMIN:
         query['owner_id'] = current_user.id
@@ -261,7 +472,10 @@ async def get_customer(customer_id: str, current_user: User = Depends(get_curren
 async def update_customer(
     customer_id: str, 
     customer_data: CustomerUpdate, 
-    current_user: User = Depends(get_current_user)
+    allow_duplicate: bool = False,
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    state: State = Depends(get_state)
 ):
     query = {"id": customer_id}
     if current_user.role != UserRole.ADMIN:
@@ -275,34 +489,86 @@ async def update_customer(
     # Update only provided fields
     update_data = {k: v for k, v in customer_data.dict().items() if v is not None}
     if update_data:
+        changes = diff_changes(existing_customer, update_data)
+        dedupe_fields = customer_dedupe_fields({**existing_customer, **update_data})
+        matches = []
+        if strong_keys_changed(existing_customer, dedupe_fields):
+            matches = await check_duplicate_customer(db, dedupe_fields, current_user, allow_duplicate,
+                                                     exclude_id=customer_id)
+        update_data.update(dedupe_fields)
+        update_data.update(customer_search_fields({**existing_customer, **update_data}))
         await db.customers.update_one(query, {"$set": update_data})
+        await suggest_merges(db, {**existing_customer, **update_data}, matches)
+        invalidate_owner_caches(state, existing_customer['owner_id'])
+        await log_activity(state.activity_log, current_user, ActivityAction.UPDATED, "customer", customer_id,
+                           customer_id, existing_customer['owner_id'], changes)
     
     # Return updated customer
     updated_customer = await db.customers.find_one(query)
     return Customer(**parse_from_mongo(updated_customer))
 
 @api_router.delete("/customers/{customer_id}")
-async def delete_customer(customer_id: str, current_user: User = Depends(get_current_user)):
+async def delete_customer(
+    customer_id: str, current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db), 
+    state: State = Depends(get_state)
+):
     query = {"id": customer_id}
     if current_user.role != UserRole.ADMIN:
         query['owner_id'] = current_user.id
     
     # Delete customer
-    result = await db.customers.delete_one(query)
-    if result.deleted_count == 0:
+    customer = await db.customers.find_one_and_delete(query, {"_id": 0, "owner_id": 1})
+    if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     # Delete associated leads
-    await db.leads.delete_many({"customer_id": customer_id})
+    delta = stats_delta(customers=-1)
+    if state.event_broker.subscribers:
+        leads = await db.leads.find({"customer_id": customer_id}, {"_id": 0, "status": 1, "value": 1}).to_list(length=None)
+        delta['total_leads'] = -len(leads)
+        delta['total_value'] = -sum(lead.get('value', 0) for lead in leads)
+        for lead in leads:
+            status = LeadStatus(lead['status']).value
+            delta['leads_by_status'][status] = delta['leads_by_status'].get(status, 0) - 1
+    relayed = 0
+    for collection in (db.leads, db.leads_archive):
+        relayed += await delete_relaying_events(db, collection, {"customer_id": customer_id})
+    if relayed:
+        state.outbox_dispatcher.notify()
+    await db.customer_merge_suggestions.delete_many({"customer_ids": customer_id})
+    invalidate_owner_caches(state, customer['owner_id'])
+    state.event_broker.publish(customer['owner_id'], "customer.deleted", {"id": customer_id})
+    publish_stats_change(state.event_broker, customer['owner_id'], delta)
+    await log_activity(state.activity_log, current_user, ActivityAction.DELETED, "customer", customer_id, customer_id,
+                       customer['owner_id'])
     
     return {"message": "Customer deleted successfully"}
 
+@api_router.get("/customers/{customer_id}/activity", response_model=List[ActivityEvent])
+async def get_customer_activity(
+    customer_id: str, 
+    skip: int = 0, 
+    limit: int = 20, 
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    # Activity outlives the customer, so access is checked against the recorded owner
+    query = {"customer_id": customer_id}
+    if current_user.role != UserRole.ADMIN:
+        query['owner_id'] = current_user.id
+    
+    events = await db.activity.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(length=None)
+    return [ActivityEvent(**parse_from_mongo(event)) for event in events]
+
 # Lead endpoints
 @api_router.post("/customers/{customer_id}/leads", response_model=Lead)
 async def create_lead(
     customer_id: str, 
     lead_data: LeadCreate, 
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    state: State = Depends(get_state)
 ):
     # Check if customer exists and user has access
     query = {"id": customer_id}
@@ -316,10 +582,26 @@ async def create_lead(
     # Create lead
     lead_dict = lead_data.dict()
     lead_dict['customer_id'] = customer_id
-    lead = Lead(**lead_dict)
+    lead = new_lead(lead_dict)
     
     lead_mongo = prepare_for_mongo(lead.dict())
-    await db.leads.insert_one(lead_mongo)
+    lead_mongo['owner_id'] = customer['owner_id']
+    event = lead_status_event(lead_mongo, None, customer['owner_id'], current_user)
+    async with write_transaction(state) as session:
+        if event and session is None:
+            # Without a transaction the event rides on the lead itself and the dispatcher relays it
+            await db.leads.insert_one({**lead_mongo, PENDING_EVENTS_FIELD: [event]})
+        else:
+            await db.leads.insert_one(lead_mongo, session=session)
+            if event:
+                await enqueue_event(db, event, session=session)
+    if event:
+        state.outbox_dispatcher.notify()
+    invalidate_owner_caches(state, customer['owner_id'])
+    publish_lead_change(state.event_broker, "lead.created", lead_mongo, customer['owner_id'], None, lead_mongo)
+    await log_activity(state.activity_log, current_user, ActivityAction.CREATED, "lead", lead.id, customer_id,
+                       customer['owner_id'],
+                       {"title": {"from": None, "to": lead.title}, "status": {"from": None, "to": lead.status}})
     
     return lead
 
@@ -327,7 +609,10 @@ async def create_lead(
 async def get_customer_leads(
     customer_id: str, 
     status: Optional[LeadStatus] = None,
-    current_user: User = Depends(get_current_user)
+    sort: Optional[LeadSortField] = None,
+    include_archived: bool = False,
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     # Check if customer exists and user has access
     customer_query = {"id": customer_id}
@@ -343,89 +628,227 @@ async def get_customer_leads(
     if status:
         leads_query['status'] = status
     
-    leads = await db.leads.find(leads_query).to_list(length=None)
+    leads = await find_leads(db, leads_query, sort, include_archived)
     return [Lead(**parse_from_mongo(lead)) for lead in leads]
 
 @api_router.get("/leads", response_model=List[Lead])
 async def get_all_leads(
     status: Optional[LeadStatus] = None,
-    current_user: User = Depends(get_current_user)
+    sort: Optional[LeadSortField] = None,
+    include_archived: bool = False,
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    state: State = Depends(get_state)
 ):
+    owner_id = None if current_user.role == UserRole.ADMIN else current_user.id
+    key = ("leads", state.read_coalescer.scope(owner_id), status, sort, include_archived)
+    return await state.read_coalescer.do(key, lambda: list_leads(db, owner_id, status, sort, include_archived))
+
+async def list_leads(
+    db,
+    owner_id: Optional[str],
+    status: Optional[LeadStatus],
+    sort: Optional[LeadSortField],
+    include_archived: bool = False,
+) -> List[Lead]:
     # Build query
     leads_query = {}
     if status:
         leads_query['status'] = status
     
     # If not admin, filter by owned customers
-    if current_user.role != UserRole.ADMIN:
+    if owner_id is not None:
         customer_ids = []
-        customers = await db.customers.find({"owner_id": current_user.id}).to_list(length=None)
+        customers = await db.customers.find({"owner_id": owner_id}).to_list(length=None)
         customer_ids = [customer['id'] for customer in customers]
         leads_query['customer_id'] = {"$in": customer_ids}
     
-    leads = await db.leads.find(leads_query).to_list(length=None)
+    leads = await find_leads(db, leads_query, sort, include_archived)
     return [Lead(**parse_from_mongo(lead)) for lead in leads]
 
+@api_router.get("/leads/board", response_model=LeadBoard)
+async def get_lead_board(
+    customer_id: Optional[str] = None,
+    status: Optional[LeadStatus] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    # Scope to one customer, or to everything the user owns
+    if customer_id:
+        customer_query = {"id": customer_id}
+        if current_user.role != UserRole.ADMIN:
+            customer_query['owner_id'] = current_user.id
+        if not await db.customers.find_one(customer_query, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Customer not found")
+        scope = {"customer_id": customer_id}
+    elif current_user.role != UserRole.ADMIN:
+        scope = {"owner_id": current_user.id}
+    else:
+        scope = {}
+    
+    # A cursor continues a single column
+    if cursor and not status:
+        raise HTTPException(status_code=400, detail="A cursor needs the status of its column")
+    statuses = [status.value] if status else [lead_status.value for lead_status in LeadStatus]
+    
+    try:
+        columns = await lead_board(db, scope, statuses, limit, cursor)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    
+    return LeadBoard(columns=[
+        LeadBoardColumn(**{**column, "leads": [Lead(**parse_from_mongo(lead)) for lead in column['leads']]})
+        for column in columns
+    ])
+
 @api_router.put("/leads/{lead_id}", response_model=Lead)
 async def update_lead(
     lead_id: str, 
     lead_data: LeadUpdate, 
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    state: State = Depends(get_state)
 ):
-    # Find lead
-    lead = await db.leads.find_one({"id": lead_id})
-    if not lead:
-        raise HTTPException(status_code=404, detail="Lead not found")
-    
-    # Check if user has access to the customer
-    if current_user.role != UserRole.ADMIN:
-        customer = await db.customers.find_one({"id": lead['customer_id'], "owner_id": current_user.id})
-        if not customer:
-            raise HTTPException(status_code=403, detail="Access denied")
+    lead, owner_id = await get_accessible_lead(db, lead_id, current_user)
     
     # Update lead
     update_data = {k: v for k, v in lead_data.dict().items() if v is not None}
     if update_data:
-        await db.leads.update_one({"id": lead_id}, {"$set": update_data})
+        now = datetime.now(timezone.utc)
+        update = {"$set": prepare_for_mongo({**update_data, "updated_at": now})}
+        if 'status' in update_data and update_data['status'] != lead.get('status'):
+            update["$push"] = {"status_history": {"status": update_data['status'], "changed_at": now.isoformat()}}
+        event = lead_status_event({**lead, **update["$set"]}, lead.get('status'), owner_id, current_user)
+        async with write_transaction(state) as session:
+            if event and session is None:
+                # Without a transaction the event rides on the lead itself and the dispatcher relays it
+                stage_event(update, event)
+            # Editing an archived lead makes it current again, even if it was archived after the read above
+            updated_lead = await apply_lead_update(db, lead_id, update, session=session)
+            if updated_lead is None:
+                raise HTTPException(status_code=404, detail="Lead not found")
+            if event and session is not None:
+                await enqueue_event(db, event, session=session)
+        if event:
+            state.outbox_dispatcher.notify()
+        invalidate_owner_caches(state, owner_id)
+        # An archived lead was not counted on the dashboard until this edit restored it
+        publish_lead_change(state.event_broker, "lead.updated", updated_lead, owner_id,
+                            None if lead.get('archived_at') else lead, updated_lead)
+        await log_activity(state.activity_log, current_user, ActivityAction.UPDATED, "lead", lead_id,
+                           lead['customer_id'], owner_id, diff_changes(lead, update_data))
+        return Lead(**parse_from_mongo(updated_lead))
     
-    # Return updated lead
-    updated_lead = await db.leads.find_one({"id": lead_id})
-    return Lead(**parse_from_mongo(updated_lead))
+    return Lead(**parse_from_mongo(lead))
 
 @api_router.delete("/leads/{lead_id}")
-async def delete_lead(lead_id: str, current_user: User = Depends(get_current_user)):
-    # Find lead
-    lead = await db.leads.find_one({"id": lead_id})
-    if not lead:
-        raise HTTPException(status_code=404, detail="Lead not found")
-    
-    # Check if user has access to the customer
-    if current_user.role != UserRole.ADMIN:
-        customer = await db.customers.find_one({"id": lead['customer_id'], "owner_id": current_user.id})
-        if not customer:
-            raise HTTPException(status_code=403, detail="Access denied")
+async def delete_lead(
+    lead_id: str, current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db), 
+    state: State = Depends(get_state)
+):
+    lead, owner_id = await get_accessible_lead(db, lead_id, current_user)
     
     # Delete lead
-    result = await db.leads.delete_one({"id": lead_id})
-    if result.deleted_count == 0:
+    collection = db.leads_archive if lead.get('archived_at') else db.leads
+    deleted = await collection.find_one_and_delete({"id": lead_id}, {"_id": 0, "id": 1, PENDING_EVENTS_FIELD: 1})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Lead not found")
     
+    # Events staged on the lead and not relayed yet still go out
+    if deleted.get(PENDING_EVENTS_FIELD):
+        await relay_events(db, deleted[PENDING_EVENTS_FIELD])
+        state.outbox_dispatcher.notify()
+    invalidate_owner_caches(state, owner_id)
+    publish_lead_change(state.event_broker, "lead.deleted", lead, owner_id, None if lead.get('archived_at') else lead,
+                        None)
+    await log_activity(state.activity_log, current_user, ActivityAction.DELETED, "lead", lead_id, lead['customer_id'],
+                       owner_id)
+    
     return {"message": "Lead deleted successfully"}
 
+@api_router.get("/leads/score", response_model=ScoringStatus)
+async def get_scoring_status(current_user: User = Depends(get_admin_user), state: State = Depends(get_state)):
+    return ScoringStatus(**await state.lead_scoring_job.status())
+
+@api_router.post("/leads/score", response_model=ScoringStatus, status_code=202)
+async def score_leads(
+    full: bool = False, current_user: User = Depends(get_admin_user), 
+    state: State = Depends(get_state)
+):
+    # A full run can take longer than a request may stay open, so it runs in the background; poll GET for the result
+    state.lead_scoring_job.request(full=full)
+    return ScoringStatus(**await state.lead_scoring_job.status())
+
+@api_router.post("/leads/archive", response_model=ArchiveRun)
+async def archive_leads(current_user: User = Depends(get_admin_user), state: State = Depends(get_state)):
+    result = await state.lead_archive_job.run()
+    if result is None:
+        raise HTTPException(status_code=409, detail="Lead archiving is already running")
+    return ArchiveRun(**result)
+
+# Webhook endpoints
+@api_router.get("/webhooks", response_model=List[Webhook])
+async def get_webhooks(current_user: User = Depends(get_admin_user), db: AsyncIOMotorDatabase = Depends(get_db)):
+    webhooks = await db.webhooks.find().to_list(length=None)
+    return [Webhook(**parse_from_mongo(webhook)) for webhook in webhooks]
+
+@api_router.post("/webhooks", response_model=Webhook)
+async def create_webhook(
+    webhook_data: WebhookCreate, current_user: User = Depends(get_admin_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    webhook = Webhook(**webhook_data.dict())
+    await db.webhooks.insert_one(prepare_for_mongo(webhook.dict()))
+    return webhook
+
+@api_router.delete("/webhooks/{webhook_id}")
+async def delete_webhook(
+    webhook_id: str, current_user: User = Depends(get_admin_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    result = await db.webhooks.delete_one({"id": webhook_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    return {"message": "Webhook deleted successfully"}
+
 # Dashboard endpoint
 @api_router.get("/dashboard/stats", response_model=DashboardStats)
-async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
+async def get_dashboard_stats(
+    include_archived: bool = False, current_user: User = Depends(get_current_user), 
+    state: State = Depends(get_state)
+):
+    owner_id = None if current_user.role == UserRole.ADMIN else current_user.id
+    key = ("dashboard_stats", state.read_coalescer.scope(owner_id), include_archived)
+    return await state.read_coalescer.do(key, lambda: dashboard_snapshot(state, owner_id, include_archived))
+
+async def dashboard_snapshot(state: State, owner_id: Optional[str], include_archived: bool = False) -> DashboardStats:
+    """Dashboard stats tagged with the last event they reflect, recounted if an event for the owner lands meanwhile"""
+    event_broker = state.event_broker
+    for _ in range(STATS_SNAPSHOT_ATTEMPTS):
+        event_id = event_broker.last_event_id
+        stats = await compute_dashboard_stats(state.db, owner_id, include_archived)
+        # With no stream open no deltas go out; a stream opened later starts after a newer id and reloads
+        if not event_broker.subscribers or not event_broker.changed_since(owner_id, event_id):
+            stats.event_id = event_id
+            return stats
+    # Left untagged, live clients reload it a bounded number of times
+    return stats
+
+async def compute_dashboard_stats(db, owner_id: Optional[str], include_archived: bool = False) -> DashboardStats:
     # Build queries based on user role
     customer_query = {}
-    if current_user.role != UserRole.ADMIN:
-        customer_query['owner_id'] = current_user.id
+    if owner_id is not None:
+        customer_query['owner_id'] = owner_id
     
     # Get customers count
     total_customers = await db.customers.count_documents(customer_query)
     
     # Get customer IDs for leads filtering
     customer_ids = []
-    if current_user.role != UserRole.ADMIN:
+    if owner_id is not None:
         customers = await db.customers.find(customer_query).to_list(length=None)
         customer_ids = [customer['id'] for customer in customers]
         leads_query = {"customer_id": {"$in": customer_ids}} if customer_ids else {"customer_id": {"$in": []}}
@@ -433,7 +856,7 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
         leads_query = {}
     
     # Get leads stats
-    leads = await db.leads.find(leads_query).to_list(length=None)
+    leads = await load_leads(db, leads_query, include_archived=include_archived)
     total_leads = len(leads)
     
     # Group leads by status
@@ -452,9 +875,71 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
         total_value=total_value
     )
 
+# Analytics endpoints
+@api_router.get("/analytics/pipeline", response_model=PipelineAnalytics)
+async def get_pipeline_analytics(
+    include_archived: bool = False, current_user: User = Depends(get_current_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db), 
+    state: State = Depends(get_state)
+):
+    owner_id = None if current_user.role == UserRole.ADMIN else current_user.id
+    
+    # Only the default view of current leads is cached; history reports are rare
+    if include_archived:
+        return PipelineAnalytics(**await compute_pipeline_analytics(db, owner_id, include_archived=True))
+    
+    cached = state.analytics_cache.get(owner_id)
+    if cached is not None:
+        return cached
+    
+    generation = state.analytics_cache.generation
+    analytics = PipelineAnalytics(**await compute_pipeline_analytics(db, owner_id))
+    state.analytics_cache.set(owner_id, analytics, generation)
+    
+    return analytics
+
+@api_router.get("/metrics/coalescing", response_model=List[CoalescingStats])
+async def get_coalescing_stats(current_user: User = Depends(get_admin_user), state: State = Depends(get_state)):
+    return [CoalescingStats(**stats) for stats in state.read_coalescer.stats()]
+
+@api_router.get("/metrics/events", response_model=EventStreamStats)
+async def get_event_stream_stats(current_user: User = Depends(get_admin_user), state: State = Depends(get_state)):
+    return EventStreamStats(
+        subscribers=state.event_broker.subscribers,
+        published=state.event_broker.published,
+        evicted=state.event_broker.evicted,
+    )
+
+# Live updates
+@api_router.post("/events/token", response_model=StreamToken)
+async def get_stream_token(current_user: User = Depends(get_current_user)):
+    return StreamToken(token=create_stream_token(current_user.id), expires_in=STREAM_TOKEN_EXPIRE_SECONDS)
+
+@api_router.get("/events/stream")
+async def event_stream(
+    request: Request, 
+    last_event_id: Optional[str] = None, 
+    current_user: User = Depends(get_stream_user), 
+    state: State = Depends(get_state)
+):
+    # Browsers resend the last id as a header on their own reconnects; clients reopening the stream pass it as a parameter
+    last_event_id = request.headers.get("Last-Event-ID") or last_event_id
+    owner_id = None if current_user.role == UserRole.ADMIN else current_user.id
+    subscription = state.event_broker.subscribe(owner_id, last_event_id)
+    return StreamingResponse(
+        stream_events(request, state.event_broker, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def leads_archived(state: State):
+    """Archiving drops leads from the default dashboard without per-lead events, so ask dashboards to refetch"""
+    invalidate_owner_caches(state)
+    state.event_broker.publish(None, "stats.stale", {})
+
 # Sample data seeding
 @api_router.post("/seed-data")
-async def seed_sample_data():
+async def seed_sample_data(db: AsyncIOMotorDatabase = Depends(get_db), state: State = Depends(get_state)):
     # Check if data already exists
     user_count = await db.users.count_documents({})
     if user_count > 0:
@@ -492,6 +977,8 @@ async def seed_sample_data():
     for customer_data in customers_data:
         customer = Customer(**customer_data)
         customer_mongo = prepare_for_mongo(customer.dict())
+        customer_mongo.update(customer_dedupe_fields(customer_data))
+        customer_mongo.update(customer_search_fields(customer_data))
         await db.customers.insert_one(customer_mongo)
         customer_objects.append(customer)
     
@@ -505,31 +992,318 @@ async def seed_sample_data():
         {"customer_id": customer_objects[3].id, "title": "Security Audit", "description": "Complete security assessment", "status": LeadStatus.CONTACTED, "value": 10000.0},
     ]
     
+    owners = {customer.id: customer.owner_id for customer in customer_objects}
     for lead_data in leads_data:
-        lead = Lead(**lead_data)
+        lead = new_lead(lead_data)
         lead_mongo = prepare_for_mongo(lead.dict())
+        lead_mongo['owner_id'] = owners[lead.customer_id]
         await db.leads.insert_one(lead_mongo)
+    invalidate_owner_caches(state)
     
     return {"message": "Sample data created successfully"}
 
-# Include the router in the main app
-app.include_router(api_router)
+# Profiling endpoints
+@api_router.get("/profiles", response_model=List[RequestProfileSummary])
+async def get_profiles(
+    skip: int = 0, 
+    limit: int = 20, 
+    current_user: User = Depends(get_admin_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    profiles = await db.profiles.find({}, {"_id": 0, "stats": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(length=None)
+    return [RequestProfileSummary(**parse_from_mongo(profile)) for profile in profiles]
+
+@api_router.get("/profiles/{profile_id}/download")
+async def download_profile(
+    profile_id: str, 
+    format: ProfileFormat = ProfileFormat.PSTATS, 
+    current_user: User = Depends(get_admin_user), 
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    profile = await db.profiles.find_one({"id": profile_id}, {"stats": 1})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    if format == ProfileFormat.COLLAPSED:
+        return Response(
+            content=collapsed_stacks(profile['stats']),
+            media_type="text/plain",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed.txt"'},
+        )
+    return Response(
+        content=bytes(profile['stats']),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.prof"'},
+    )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def token_subject(request: Request) -> Optional[str]:
+    """User id from the request's bearer token, if it carries a valid one"""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except jwt.PyJWTError:
+        return None
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+async def profile_trigger(request: Request, sampled: bool) -> Optional[str]:
+    """Why this request should be profiled, or None to run it normally"""
+    settings = request.app.state.settings
+    path = request.url.path
+    if not path.startswith("/api/") or path.startswith(UNPROFILED_PATHS):
+        return None
+    
+    if request.headers.get(PROFILE_HEADER):
+        user_id = token_subject(request)
+        user = await request.app.state.db.users.find_one({"id": user_id}, {"_id": 0, "role": 1}) if user_id else None
+        if user and user.get('role') == UserRole.ADMIN:
+            return "header"
+    
+    if sampled:
+        if not settings.profile_paths or any(path.startswith(prefix) for prefix in settings.profile_paths):
+            return "sample"
+    return None
+
+class ProfilingMiddleware:
+    """Profiles requests that ask for it or are sampled; every other request passes straight through"""
+    
+    def __init__(self, app):
+        self.app = app
+        # Requests running now and started so far, to tell how many shared the loop with a profiled one
+        self.in_flight = 0
+        self.started = 0
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        self.in_flight += 1
+        self.started += 1
+        try:
+            await self._call(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+    
+    async def _call(self, scope, receive, send):
+        request = Request(scope)
+        state = request.app.state
+        settings = state.settings
+        sampled = settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate
+        if not sampled and not request.headers.get(PROFILE_HEADER):
+            return await self.app(scope, receive, send)
+        
+        trigger = await profile_trigger(request, sampled)
+        profile = RequestProfile(max_seconds=settings.profile_max_seconds)
+        if trigger is None or not profile.start():
+            return await self.app(scope, receive, send)
+        
+        # Requests already running, plus those started while the profile is open
+        overlapping = self.in_flight - 1 - self.started
+        profile_id = str(uuid.uuid4())
+        status_code = 500
+        
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", profile_id)
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            overlapping += self.started
+            await state.db.profiles.insert_one({
+                "id": profile_id,
+                "method": request.method,
+                "path": request.url.path,
+                "query": request.url.query,
+                "user_id": token_subject(request),
+                "trigger": trigger,
+                "status_code": status_code,
+                "breakdown": profile.breakdown(),
+                "loop_wide": LOOP_WIDE_KEYS,
+                "overlapping_requests": overlapping,
+                "truncated": profile.truncated,
+                "mongo_commands": profile.mongo_commands,
+                "top_functions": profile.top_functions(),
+                "stats": Binary(profile.dump()),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            })
+
+# Health endpoints
+@health_router.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@health_router.get("/readyz")
+async def readyz(request: Request):
+    if not request.app.state.ready:
+        raise HTTPException(status_code=503, detail="Starting up")
+    try:
+        await asyncio.wait_for(request.app.state.db.command("ping"), READY_PING_TIMEOUT)
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready"}
+
+def create_mongo_client(settings: Settings) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        settings.mongo_url,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+        connectTimeoutMS=settings.mongo_connect_timeout_ms,
+        serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+        socketTimeoutMS=settings.mongo_socket_timeout_ms,
+        waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+        event_listeners=[MongoCommandTimer()],
+    )
+
+async def warm_up(database, connections: int):
+    """Ping over several connections at once so the pool is open before the first request"""
+    await asyncio.gather(*(database.command("ping") for _ in range(max(connections, 1))))
+
+async def ensure_indexes(database):
+    # The builds are independent, so startup waits for the slowest one rather than for all of them in turn
+    await asyncio.gather(
+        database.jobs.create_index("name", unique=True),
+        database.customers.create_index("dedupe_keys"),
+        database.customers.create_index([("owner_id", 1), ("search_terms", 1)]),
+        database.customers.create_index("search_terms"),
+        database.customers.create_index([("owner_id", 1), ("search_name", 1)]),
+        database.customers.create_index("search_name"),
+        database.customers.create_index([("owner_id", 1), ("search_company", 1), ("search_name", 1)]),
+        database.customers.create_index([("search_company", 1), ("search_name", 1)]),
+        database.customer_merge_suggestions.create_index("pair_id", unique=True),
+        database.customer_merge_suggestions.create_index([("status", 1), ("score", -1)]),
+        database.leads.create_index("id"),
+        # Score-sorted listings, including their created_at tiebreak
+        database.leads.create_index([("customer_id", 1), ("score", -1), ("created_at", -1)]),
+        database.leads.create_index([("score", -1), ("created_at", -1)]),
+        database.leads.create_index([("updated_at", 1)]),
+        # Lead board columns, per scope
+        database.leads.create_index([("status", 1), ("created_at", -1), ("id", -1)]),
+        database.leads.create_index([("owner_id", 1), ("status", 1), ("created_at", -1), ("id", -1)]),
+        database.leads.create_index([("customer_id", 1), ("status", 1), ("created_at", -1), ("id", -1)]),
+        # Archiving job, and lead lookups that fall back to the archive
+        database.leads.create_index([("status", 1), ("updated_at", 1)]),
+        database.leads_archive.create_index("id", unique=True),
+        database.leads_archive.create_index([("customer_id", 1), ("created_at", -1)]),
+        database.leads_archive.create_index([("owner_id", 1), ("status", 1)]),
+        database.activity.create_index([("customer_id", 1), ("created_at", -1)]),
+        database.outbox.create_index("id"),
+        database.outbox.create_index([("status", 1), ("next_attempt_at", 1)]),
+        database.outbox.create_index("claim", sparse=True),
+        database.leads.create_index(f"{PENDING_EVENTS_FIELD}.id", sparse=True),
+        database.leads_archive.create_index(f"{PENDING_EVENTS_FIELD}.id", sparse=True),
+        database.profiles.create_index("id"),
+        database.profiles.create_index([("created_at", -1)]),
+    )
+
+async def backfill_fields(state: State):
+    """Add dedupe keys and search terms to customers and owners to leads written before those fields existed"""
+    database = state.db
+    try:
+        # First, so the duplicate check on create sees existing customers as soon as possible
+        deduped = await backfill_dedupe_fields(database)
+        customers = await backfill_search_terms(database)
+        leads = await backfill_lead_owners(database)
+    except Exception:
+        logger.exception("Backfill failed")
+        return
+    if deduped or customers or leads:
+        # Results cached while the backfill ran may have missed the customers and leads it just filled in
+        invalidate_owner_caches(state)
+        logger.info("Backfilled dedupe keys for %d customers, search terms for %d customers and owners for %d leads",
+                    deduped, customers, leads)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    state = app.state
+    settings = state.settings
+    
+    started = time.perf_counter()
+    state.client = client = create_mongo_client(settings)
+    state.db = db = client[settings.db_name]
+    await warm_up(db, settings.warmup_connections)
+    await ensure_indexes(db)
+    
+    # Analytics results and autocomplete prefixes are cached per owner and dropped on writes
+    state.analytics_cache = AnalyticsCache(ttl_seconds=settings.analytics_cache_ttl)
+    state.prefix_cache = PrefixCache(ttl_seconds=settings.prefix_cache_ttl)
+    # Identical concurrent reads of the dashboard and lead listings share one query
+    state.read_coalescer = SingleFlight(ttl_seconds=settings.coalesce_result_ttl)
+    # Lead changes and dashboard counter deltas pushed to open event streams
+    state.event_broker = event_broker = EventBroker(max_queue_size=settings.event_queue_size)
+    state.activity_log = activity_log = ActivityLog(
+        db,
+        max_queue_size=settings.activity_queue_size,
+        batch_size=settings.activity_batch_size,
+        flush_interval_seconds=settings.activity_flush_interval,
+    )
+    state.outbox_dispatcher = outbox_dispatcher = OutboxDispatcher(
+        db,
+        webhook_urls=settings.webhook_urls,
+        batch_size=settings.outbox_batch_size,
+        max_attempts=settings.outbox_max_attempts,
+        # Archived leads keep the events staged on them when they were moved
+        relay_collections=["leads", "leads_archive"],
+    )
+    state.lead_scoring_job = lead_scoring_job = LeadScoringJob(
+        db,
+        interval_seconds=settings.scoring_interval,
+        workers=settings.scoring_workers,
+    )
+    state.duplicate_scan_job = duplicate_scan_job = DuplicateScanJob(db, interval_seconds=settings.duplicate_scan_interval)
+    state.lead_archive_job = lead_archive_job = LeadArchiveJob(
+        db,
+        max_age_days=settings.archive_after_days,
+        interval_seconds=settings.archive_interval,
+        on_archived=lambda: leads_archived(state),
+    )
+    activity_log.start()
+    backfill_task = None
+    if settings.run_background_jobs:
+        outbox_dispatcher.start()
+        lead_scoring_job.start()
+        lead_archive_job.start()
+        duplicate_scan_job.start()
+        backfill_task = asyncio.create_task(backfill_fields(state))
+    
+    state.ready = True
+    logger.info("Ready in %.3fs", time.perf_counter() - started)
+    try:
+        yield
+    finally:
+        state.ready = False
+        event_broker.close()
+        if backfill_task is not None:
+            backfill_task.cancel()
+        await duplicate_scan_job.stop()
+        await lead_archive_job.stop()
+        await lead_scoring_job.stop()
+        await outbox_dispatcher.stop()
+        await activity_log.stop()
+        client.close()
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Build the API app; the Mongo client and background workers are opened by its lifespan"""
+    app = FastAPI(title="Mini CRM API", version="1.0.0", lifespan=lifespan)
+    app.state.settings = settings or Settings.from_env()
+    app.state.ready = False
+    
+    app.include_router(api_router)
+    app.include_router(health_router)
+    
+    app.add_middleware(ProfilingMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=app.state.settings.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+app = create_app()
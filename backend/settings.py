@@ -0,0 +1,85 @@
+import os
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+def _env_list(name: str, default: str = '') -> List[str]:
+    return [item.strip() for item in os.environ.get(name, default).split(',') if item.strip()]
+
+
+def _env_bool(name: str, default: str = 'false') -> bool:
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+class Settings(BaseModel):
+    mongo_url: str
+    db_name: str
+    cors_origins: List[str] = ['*']
+
+    # Connection pool; see https://pymongo.readthedocs.io/en/stable/api/pymongo/mongo_client.html
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 10
+    mongo_max_idle_time_ms: int = 300000
+    mongo_connect_timeout_ms: int = 5000
+    mongo_server_selection_timeout_ms: int = 10000
+    mongo_socket_timeout_ms: Optional[int] = None
+    mongo_wait_queue_timeout_ms: Optional[int] = 5000
+    # Multi-document transactions need a replica set; enable them to commit writes and outbox events atomically
+    mongo_transactions: bool = False
+
+    # Connections opened and pinged during startup, before the app reports ready
+    warmup_connections: int = 10
+    # Disable on extra workers so only some processes run the background jobs; at least one must, as staged
+    # webhook events are only relayed and delivered by a process running them
+    run_background_jobs: bool = True
+
+    analytics_cache_ttl: float = 300
+    # Writes only invalidate the worker that handled them; other workers' autocomplete prefixes age out after this
+    prefix_cache_ttl: float = 60
+    # Concurrent identical reads always share one query; this also reuses its result for a few seconds
+    coalesce_result_ttl: float = 0.0
+
+    scoring_interval: float = 900
+    scoring_workers: Optional[int] = None
+
+    # Converted and Lost leads untouched for this long move to the leads_archive collection
+    archive_after_days: float = 180
+    archive_interval: float = 3600
+
+    duplicate_scan_interval: float = 86400
+
+    activity_queue_size: int = 10000
+    activity_batch_size: int = 500
+    activity_flush_interval: float = 1.0
+
+    # Events buffered per open /api/events/stream before the subscriber is evicted
+    event_queue_size: int = 100
+
+    webhook_urls: List[str] = []
+    outbox_batch_size: int = 100
+    outbox_max_attempts: int = 10
+
+    # Share of requests profiled without being asked to, limited to paths starting with profile_paths (all of /api when empty)
+    profile_sample_rate: float = 0.0
+    profile_paths: List[str] = []
+    # Profiling stops after this long so a slow or long-lived response can't hold the profiler
+    profile_max_seconds: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Read settings from the environment, falling back to the defaults above"""
+        values = {
+            'mongo_url': os.environ['MONGO_URL'],
+            'db_name': os.environ['DB_NAME'],
+            'cors_origins': _env_list('CORS_ORIGINS', '*'),
+            'webhook_urls': _env_list('WEBHOOK_URLS'),
+            'profile_paths': _env_list('PROFILE_PATHS'),
+            'mongo_transactions': _env_bool('MONGO_TRANSACTIONS'),
+            'run_background_jobs': _env_bool('RUN_BACKGROUND_JOBS', 'true'),
+        }
+        for field in cls.model_fields:
+            env_name = field.upper()
+            if field not in values and os.environ.get(env_name):
+                values[field] = os.environ[env_name]
+        return cls(**values)
@@ -1,10 +1,48 @@
 import requests
 import sys
 import json
+import os
+import time
+import threading
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+class StandInReceiver:
+    """Local webhook endpoint that records every delivered batch"""
+
+    def __init__(self):
+        received = self.received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                received.extend(json.loads(body).get('events', []))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(('0.0.0.0', 0), Handler)
+        self.url = f"http://{os.environ.get('WEBHOOK_RECEIVER_HOST', 'localhost')}:{self.server.server_port}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait_for(self, event_type, aggregate_id, timeout=15):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for event in self.received:
+                if event.get('type') == event_type and event.get('aggregate_id') == aggregate_id:
+                    return event
+            time.sleep(0.5)
+        return None
+
+    def close(self):
+        self.server.shutdown()
 
 class MiniCRMAPITester:
-    def __init__(self, base_url="https://mini-crm-2.preview.emergentagent.com"):
+    def __init__(self, base_url=None):
+        # Point BACKEND_URL at a local server so it can reach the webhook receiver at WEBHOOK_RECEIVER_HOST
+        base_url = base_url or os.environ.get('BACKEND_URL', "https://mini-crm-2.preview.emergentagent.com")
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
         self.admin_token = None
@@ -29,7 +67,7 @@ class MiniCRMAPITester:
             if method == 'GET':
                 response = requests.get(url, headers=headers, params=params)
             elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers)
+                response = requests.post(url, json=data, headers=headers, params=params)
             elif method == 'PUT':
                 response = requests.put(url, json=data, headers=headers)
             elif method == 'DELETE':
@@ -98,6 +136,199 @@ class MiniCRMAPITester:
             print(f"✅ Dashboard stats complete for {user_type}")
         return success
 
+    def test_pipeline_analytics(self, token, user_type):
+        """Test pipeline analytics endpoint"""
+        success, response = self.run_test(
+            f"Pipeline analytics ({user_type})",
+            "GET",
+            "analytics/pipeline",
+            200,
+            token=token
+        )
+        if success:
+            required_fields = ['total_leads', 'value_percentiles', 'conversion_by_owner',
+                               'conversion_by_company', 'win_rate_by_value_band', 'forecast']
+            for field in required_fields:
+                if field not in response:
+                    print(f"❌ Missing field in pipeline analytics: {field}")
+                    return False
+            print(f"✅ Pipeline analytics complete for {user_type}")
+        return success
+
+    def test_event_stream(self, token):
+        """Test a stream starts with hello and a lead created while it is open arrives as an event"""
+        print("\n📡 Testing Event Stream...")
+        received = []
+        
+        # The stream takes a short-lived stream token in the URL, not the login token
+        success, stream_token = self.run_test("Get stream token", "POST", "events/token", 200, token=token)
+        if not success:
+            return False
+        
+        def listen():
+            params = {'token': stream_token['token']}
+            with requests.get(f"{self.api_url}/events/stream", params=params, stream=True, timeout=10) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith('event:'):
+                        received.append(line[len('event:'):].strip())
+                    if 'lead.created' in received:
+                        return
+        
+        listener = threading.Thread(target=listen, daemon=True)
+        listener.start()
+        time.sleep(1)
+        
+        # Created on the test customer so cleanup removes it
+        if not self.test_customer_id:
+            return False
+        self.run_test(
+            "Create lead while streaming",
+            "POST",
+            f"customers/{self.test_customer_id}/leads",
+            200,
+            data={"title": "Streamed Lead", "description": "Created during stream test", "value": 1000.0},
+            token=token
+        )
+        listener.join(timeout=10)
+        
+        self.tests_run += 1
+        if not received or received[0] != 'hello':
+            print(f"❌ Stream did not start with hello (got {received})")
+            return False
+        if 'lead.created' not in received:
+            print(f"❌ No lead.created event received (got {received})")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Stream delivered {received}")
+        return True
+
+    def test_lead_archiving(self, admin_token, user_token):
+        """Test archiving is admin-only and archived leads stay reachable"""
+        print("\n🗄️ Testing Lead Archiving...")
+        self.run_test("Archive leads (user)", "POST", "leads/archive", 403, token=user_token)
+        success, run = self.run_test("Archive leads (admin)", "POST", "leads/archive", 200, token=admin_token)
+        if not success:
+            return False
+        
+        _, hot = self.run_test("Get hot leads", "GET", "leads", 200, token=admin_token)
+        success, everything = self.run_test(
+            "Get leads including archive",
+            "GET",
+            "leads",
+            200,
+            token=admin_token,
+            params={"include_archived": "true"}
+        )
+        if success and len(everything) < len(hot):
+            print("❌ Archive listing returned fewer leads than the hot listing")
+            return False
+        print(f"✅ Archived {run['archived']} leads; {len(everything) - len(hot)} archived in total")
+        return success
+
+    def test_read_coalescing(self, admin_token):
+        """Test concurrent identical dashboard reads are reported as coalesced"""
+        print("\n🔀 Testing Read Coalescing...")
+        headers = {'Authorization': f'Bearer {admin_token}'}
+        # Released together so the reads overlap on the server
+        start = threading.Barrier(10)
+        
+        def read():
+            start.wait()
+            requests.get(f"{self.api_url}/dashboard/stats", headers=headers)
+        
+        threads = [threading.Thread(target=read) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        success, stats = self.run_test(
+            "Coalescing metrics",
+            "GET",
+            "metrics/coalescing",
+            200,
+            token=admin_token
+        )
+        if success:
+            dashboard = next((route for route in stats if route['route'] == 'dashboard_stats'), None)
+            if not dashboard or dashboard['calls'] < 10:
+                print("❌ Dashboard reads missing from coalescing metrics")
+                return False
+            if dashboard['coalesced'] + dashboard['reused'] == 0:
+                print("❌ No concurrent dashboard read was coalesced")
+                return False
+            print(f"✅ Dashboard coalescing ratio: {dashboard['coalescing_ratio']}")
+        return success
+
+    def test_lead_board(self, token, user_type):
+        """Test lead board columns and their cursors"""
+        success, board = self.run_test(
+            f"Lead board ({user_type})",
+            "GET",
+            "leads/board",
+            200,
+            token=token,
+            params={"limit": 1}
+        )
+        if not success:
+            return False
+        
+        for column in board['columns']:
+            if len(column['leads']) > 1 or (column['count'] > 1) != bool(column['next_cursor']):
+                print(f"❌ Column {column['status']} does not page correctly")
+                return False
+            if column['next_cursor']:
+                success, _ = self.run_test(
+                    f"Lead board next page ({column['status']})",
+                    "GET",
+                    "leads/board",
+                    200,
+                    token=token,
+                    params={"limit": 1, "status": column['status'], "cursor": column['next_cursor']}
+                )
+        print(f"✅ Lead board has {len(board['columns'])} columns for {user_type}")
+        return success
+
+    def test_request_profiling(self, admin_token, user_token):
+        """Test on-demand profiling is admin-only and downloadable"""
+        print("\n⏱️ Testing Request Profiling...")
+        
+        profiled = requests.get(f"{self.api_url}/leads", headers={
+            'Authorization': f'Bearer {admin_token}', 'X-Profile': '1'
+        })
+        ignored = requests.get(f"{self.api_url}/leads", headers={
+            'Authorization': f'Bearer {user_token}', 'X-Profile': '1'
+        })
+        self.tests_run += 1
+        profile_id = profiled.headers.get('X-Profile-Id')
+        if not profile_id or 'X-Profile-Id' in ignored.headers:
+            print("❌ Profile header honoured for the wrong user")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Request profiled as {profile_id}")
+        
+        success, profiles = self.run_test(
+            "List profiles (admin)",
+            "GET",
+            "profiles",
+            200,
+            token=admin_token
+        )
+        if not success or not any(profile['id'] == profile_id for profile in profiles):
+            return False
+        print(f"   Breakdown: {profiles[0]['breakdown']}")
+        
+        self.run_test("List profiles (user)", "GET", "profiles", 403, token=user_token)
+        success, _ = self.run_test(
+            "Download collapsed stacks",
+            "GET",
+            f"profiles/{profile_id}/download",
+            200,
+            token=admin_token,
+            params={"format": "collapsed"}
+        )
+        return success
+
     def test_customer_operations(self, token, user_type):
         """Test customer CRUD operations"""
         print(f"\n👥 Testing Customer Operations ({user_type})...")
@@ -152,6 +383,53 @@ class MiniCRMAPITester:
         self.test_customer_id = customer_id
         print(f"✅ Created customer with ID: {customer_id}")
 
+        # Test duplicate detection on create
+        success, _ = self.run_test(
+            f"Reject duplicate customer ({user_type})",
+            "POST",
+            "customers",
+            409,
+            data=test_customer_data,
+            token=token
+        )
+        if not success:
+            return False
+
+        # Test the duplicate can still be saved on purpose
+        success, duplicate_response = self.run_test(
+            f"Allow duplicate customer ({user_type})",
+            "POST",
+            "customers",
+            200,
+            data=test_customer_data,
+            token=token,
+            params={"allow_duplicate": "true"}
+        )
+        if not success:
+            return False
+        self.run_test(
+            f"Delete duplicate customer ({user_type})",
+            "DELETE",
+            f"customers/{duplicate_response.get('id')}",
+            200,
+            token=token
+        )
+
+        # Test autocomplete finds the new customer by prefix
+        success, suggestions = self.run_test(
+            f"Autocomplete customers ({user_type})",
+            "GET",
+            "customers/autocomplete",
+            200,
+            token=token,
+            params={"q": test_customer_data['name'][:6]}
+        )
+        if not success:
+            return False
+        if customer_id not in [suggestion.get('id') for suggestion in suggestions]:
+            print("❌ Autocomplete did not return the new customer")
+            return False
+
         # Test GET specific customer
         success, _ = self.run_test(
             f"Get specific customer ({user_type})",
@@ -269,6 +547,147 @@ class MiniCRMAPITester:
 
         return True
 
+    def test_lead_scoring(self, admin_token, user_token):
+        """Test lead scoring run and score-sorted listing"""
+        print("\n🎯 Testing Lead Scoring...")
+
+        # Only admins can trigger a scoring run
+        success, _ = self.run_test(
+            "User - Run lead scoring",
+            "POST",
+            "leads/score",
+            403,
+            token=user_token
+        )
+        if not success:
+            return False
+
+        success, response = self.run_test(
+            "Admin - Run lead scoring",
+            "POST",
+            "leads/score",
+            202,
+            token=admin_token
+        )
+        if not success:
+            return False
+        
+        # The run happens in the background; wait for it to finish
+        for _ in range(60):
+            success, response = self.run_test("Lead scoring status", "GET", "leads/score", 200, token=admin_token)
+            if not success:
+                return False
+            if response['last_run'] and not response['running']:
+                break
+            time.sleep(1)
+        else:
+            print("❌ Lead scoring did not finish")
+            return False
+        print(f"   Scored {response['last_run']['scored']} leads ({response['last_run']['mode']})")
+
+        success, leads = self.run_test(
+            "Get leads sorted by score",
+            "GET",
+            "leads",
+            200,
+            token=admin_token,
+            params={"sort": "score"}
+        )
+        if not success:
+            return False
+
+        scores = [lead.get('score') for lead in leads if lead.get('score') is not None]
+        if scores != sorted(scores, reverse=True):
+            print("❌ Leads are not sorted by score")
+            return False
+        print("✅ Lead scoring working correctly")
+        return True
+
+    def test_customer_activity(self, token, user_type):
+        """Test per-customer activity log"""
+        if not self.test_customer_id:
+            print("❌ No test customer available for activity log")
+            return False
+
+        # Events are written behind the request, so give the flusher a moment
+        time.sleep(2)
+        success, events = self.run_test(
+            f"Get customer activity ({user_type})",
+            "GET",
+            f"customers/{self.test_customer_id}/activity",
+            200,
+            token=token,
+            params={"limit": 50}
+        )
+        if not success:
+            return False
+
+        actions = {(event.get('entity_type'), event.get('action')) for event in events}
+        for expected in [("customer", "created"), ("customer", "updated"), ("lead", "created")]:
+            if expected not in actions:
+                print(f"❌ Missing activity event: {expected}")
+                return False
+        print(f"✅ Activity log has {len(events)} events")
+        return True
+
+    def test_webhook_delivery(self, admin_token, user_token):
+        """Test lead status events are delivered to a registered webhook"""
+        if not self.test_customer_id:
+            print("❌ No test customer available for webhook delivery")
+            return False
+
+        print("\n📬 Testing Webhook Delivery...")
+        receiver = StandInReceiver()
+        try:
+            success, webhook = self.run_test(
+                "Admin - Register webhook",
+                "POST",
+                "webhooks",
+                200,
+                data={"url": receiver.url, "event_types": ["lead.converted"]},
+                token=admin_token
+            )
+            if not success:
+                return False
+
+            success, lead = self.run_test(
+                "Create lead for webhook",
+                "POST",
+                f"customers/{self.test_customer_id}/leads",
+                200,
+                data={"title": "Webhook Lead", "description": "Converted by test", "status": "New", "value": 1000.0},
+                token=user_token
+            )
+            if not success:
+                return False
+
+            success, _ = self.run_test(
+                "Convert lead",
+                "PUT",
+                f"leads/{lead['id']}",
+                200,
+                data={"status": "Converted"},
+                token=user_token
+            )
+            if not success:
+                return False
+
+            event = receiver.wait_for("lead.converted", lead['id'])
+            self.run_test(
+                "Admin - Delete webhook",
+                "DELETE",
+                f"webhooks/{webhook['id']}",
+                200,
+                token=admin_token
+            )
+            if not event:
+                print("❌ lead.converted event was not delivered")
+                return False
+            print(f"✅ Delivered {event['type']} for lead {event['aggregate_id']}")
+            return True
+        finally:
+            receiver.close()
+
     def test_role_based_access(self):
         """Test role-based access control"""
         print(f"\n🔒 Testing Role-Based Access Control...")
@@ -375,6 +794,10 @@ def main():
     tester.test_dashboard_stats(admin_token, "admin")
     tester.test_dashboard_stats(user_token, "user")
 
+    # Test pipeline analytics for both users
+    tester.test_pipeline_analytics(admin_token, "admin")
+    tester.test_pipeline_analytics(user_token, "user")
+
     # Test customer operations for user
     if not tester.test_customer_operations(user_token, "user"):
         print("❌ Customer operations failed")
@@ -385,6 +808,31 @@ def main():
         print("❌ Lead operations failed")
         return 1
 
+    # Test read coalescing
+    tester.test_read_coalescing(admin_token)
+
+    # Test lead board
+    tester.test_lead_board(admin_token, "admin")
+    tester.test_lead_board(user_token, "user")
+
+    # Test activity log
+    tester.test_customer_activity(user_token, "user")
+
+    # Test webhook delivery
+    tester.test_webhook_delivery(admin_token, user_token)
+
+    # Test event stream
+    tester.test_event_stream(user_token)
+
+    # Test lead archiving
+    tester.test_lead_archiving(admin_token, user_token)
+
+    # Test lead scoring
+    tester.test_lead_scoring(admin_token, user_token)
+
+    # Test request profiling
+    tester.test_request_profiling(admin_token, user_token)
+
     # Test role-based access
     tester.test_role_based_access()
 
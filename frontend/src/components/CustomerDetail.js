@@ -14,10 +14,14 @@ import {
   Target
 } from 'lucide-react';
 import LeadForm from './LeadForm';
+import { openEventStream } from '../lib/event-stream';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Lead changes pushed over the live stream are refetched after this long, so a burst becomes one request
+const REFRESH_DELAY_MS = 1000;
+
 const CustomerDetail = () => {
   const { id } = useParams();
   const [customer, setCustomer] = useState(null);
@@ -34,6 +38,49 @@ const CustomerDetail = () => {
     }
   }, [id]);
 
+  // Live updates. Lead events only carry a summary, so a change to this customer's leads refetches the
+  // list; a burst of them, a new stream that may have missed some, or stats.stale becomes one refetch.
+  useEffect(() => {
+    if (!id) return undefined;
+
+    let stopped = false;
+    let refreshTimer = null;
+
+    const scheduleRefresh = () => {
+      if (stopped || refreshTimer) return;
+      refreshTimer = setTimeout(async () => {
+        refreshTimer = null;
+        try {
+          const leadsResponse = await axios.get(`${API}/customers/${id}/leads`);
+          if (!stopped) setLeads(leadsResponse.data);
+        } catch (error) {
+          console.error('Error refreshing customer leads:', error);
+        }
+      }, REFRESH_DELAY_MS);
+    };
+
+    const leadChanged = (lead) => {
+      if (lead.customer_id === id) scheduleRefresh();
+    };
+
+    const closeStream = openEventStream({
+      hello: scheduleRefresh,
+      'stats.stale': scheduleRefresh,
+      'lead.created': leadChanged,
+      'lead.updated': leadChanged,
+      'lead.deleted': leadChanged,
+      'customer.deleted': (deleted) => {
+        if (deleted.id === id) setError('This customer has been deleted');
+      },
+    });
+
+    return () => {
+      stopped = true;
+      clearTimeout(refreshTimer);
+      closeStream();
+    };
+  }, [id]);
+
   const fetchCustomerData = async () => {
     try {
       setLoading(true);
@@ -14,6 +14,7 @@ const CustomerForm = ({ customer, onSuccess, onCancel }) => {
   });
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const [duplicate, setDuplicate] = useState(false);
 
   useEffect(() => {
     if (customer) {
@@ -26,29 +27,38 @@ const CustomerForm = ({ customer, onSuccess, onCancel }) => {
     }
   }, [customer]);
 
-  const handleSubmit = async (e) => {
-    e.preventDefault();
+  const saveCustomer = async (allowDuplicate) => {
     setError('');
+    setDuplicate(false);
     setLoading(true);
 
+    // Saving anyway after a duplicate warning keeps both customers
+    const config = allowDuplicate ? { params: { allow_duplicate: true } } : undefined;
+
     try {
       if (customer) {
         // Update existing customer
-        await axios.put(`${API}/customers/${customer.id}`, formData);
+        await axios.put(`${API}/customers/${customer.id}`, formData, config);
       } else {
         // Create new customer
-        await axios.post(`${API}/customers`, formData);
+        await axios.post(`${API}/customers`, formData, config);
       }
       
       onSuccess();
     } catch (error) {
       console.error('Error saving customer:', error);
       setError(error.response?.data?.detail || 'Failed to save customer');
+      setDuplicate(error.response?.status === 409);
     } finally {
       setLoading(false);
     }
   };
 
+  const handleSubmit = (e) => {
+    e.preventDefault();
+    saveCustomer(false);
+  };
+
   const handleChange = (e) => {
     setFormData(prev => ({
       ...prev,
@@ -72,6 +82,16 @@ const CustomerForm = ({ customer, onSuccess, onCancel }) => {
           {error && (
             <div className="error-message">
               {error}
+              {duplicate && (
+                <button
+                  type="button"
+                  onClick={() => saveCustomer(true)}
+                  className="btn-secondary mt-2"
+                  disabled={loading}
+                >
+                  Save anyway
+                </button>
+              )}
             </div>
           )}
 
@@ -18,6 +18,7 @@ import {
   ArcElement,
 } from 'chart.js';
 import { Bar, Pie } from 'react-chartjs-2';
+import { compareEventIds, openEventStream } from '../lib/event-stream';
 
 ChartJS.register(
   CategoryScale,
@@ -32,6 +33,10 @@ ChartJS.register(
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Reloads asked for by the live stream wait this long, so a burst of them becomes one
+const RELOAD_DELAY_MS = 1000;
+const MAX_RELOADS = 3;
+
 const Dashboard = () => {
   const [stats, setStats] = useState(null);
   const [recentCustomers, setRecentCustomers] = useState([]);
@@ -39,14 +44,128 @@ const Dashboard = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
 
+  // Load once on mount, then keep the dashboard live. Stats snapshots carry the id of the last event
+  // they reflect, so a stats delta is applied only when it is newer than the snapshot on screen, and
+  // events arriving while a snapshot loads wait for it. List updates are idempotent and always applied.
   useEffect(() => {
-    fetchDashboardData();
+    let stopped = false;
+    let snapshotId = null;
+    let streamStart = null;
+    let loadingSnapshot = false;
+    let pending = [];
+    let reloadTimer = null;
+    let reloads = 0;
+
+    const addStatsDelta = (delta) => {
+      setStats((current) => {
+        if (!current) return current;
+        const leadsByStatus = { ...current.leads_by_status };
+        Object.entries(delta.leads_by_status).forEach(([status, count]) => {
+          leadsByStatus[status] = (leadsByStatus[status] || 0) + count;
+        });
+        return {
+          ...current,
+          total_customers: current.total_customers + delta.total_customers,
+          total_leads: current.total_leads + delta.total_leads,
+          total_value: current.total_value + delta.total_value,
+          leads_by_status: leadsByStatus,
+        };
+      });
+    };
+
+    const listHandlers = {
+      'lead.created': (lead) => {
+        setRecentLeads((current) => [lead, ...current.filter((item) => item.id !== lead.id)].slice(0, 5));
+      },
+      'lead.updated': (lead) => {
+        setRecentLeads((current) => current.map((item) => (item.id === lead.id ? { ...item, ...lead } : item)));
+      },
+      'lead.deleted': (lead) => {
+        setRecentLeads((current) => current.filter((item) => item.id !== lead.id));
+      },
+      'customer.deleted': (customer) => {
+        setRecentCustomers((current) => current.filter((item) => item.id !== customer.id));
+        setRecentLeads((current) => current.filter((item) => item.customer_id !== customer.id));
+      },
+    };
+
+    // Events published before the stream started only reach a snapshot taken after that point
+    const snapshotCoversStream = () => {
+      const order = compareEventIds(snapshotId, streamStart);
+      return order !== null && order >= 0;
+    };
+
+    // Reloads are spaced out and merged, and stop after a few in a row that could not be ordered
+    // against the stream (e.g. served by another worker) until the next stream or stats.stale
+    const scheduleReload = () => {
+      if (stopped || reloadTimer || reloads >= MAX_RELOADS) return;
+      reloads += 1;
+      const fire = () => {
+        reloadTimer = loadingSnapshot ? setTimeout(fire, RELOAD_DELAY_MS) : null;
+        if (!reloadTimer) load();
+      };
+      reloadTimer = setTimeout(fire, RELOAD_DELAY_MS);
+    };
+
+    const load = async () => {
+      loadingSnapshot = true;
+      const snapshot = await fetchDashboardData();
+      loadingSnapshot = false;
+      if (stopped) return;
+
+      const queued = pending;
+      pending = [];
+      if (!snapshot) return;
+      snapshotId = snapshot.event_id || null;
+      queued.forEach(({ type, data, eventId }) => {
+        if (type !== 'stats.changed') listHandlers[type](data);
+        else if (compareEventIds(eventId, snapshotId) > 0) addStatsDelta(data);
+      });
+
+      if (streamStart && !snapshotCoversStream()) scheduleReload();
+      else reloads = 0;
+    };
+
+    const receive = (type) => (data, eventId) => {
+      if (loadingSnapshot) {
+        pending.push({ type, data, eventId });
+      } else if (type !== 'stats.changed') {
+        listHandlers[type](data);
+      } else {
+        // Deltas that cannot be ordered against the snapshot are applied; a reload replaces them if needed
+        const order = compareEventIds(eventId, snapshotId);
+        if (order === null || order > 0) addStatsDelta(data);
+      }
+    };
+
+    const handlers = {
+      hello: (data, eventId) => {
+        streamStart = eventId;
+        reloads = 0;
+        if (!loadingSnapshot && !snapshotCoversStream()) scheduleReload();
+      },
+      // The server asks for a full reload when it could not send every delta
+      'stats.stale': () => scheduleReload(),
+      'stats.changed': receive('stats.changed'),
+    };
+    Object.keys(listHandlers).forEach((type) => {
+      handlers[type] = receive(type);
+    });
+
+    load();
+    const closeStream = openEventStream(handlers);
+
+    return () => {
+      stopped = true;
+      clearTimeout(reloadTimer);
+      closeStream();
+    };
   }, []);
 
+  // Returns the stats snapshot, or null when loading failed
   const fetchDashboardData = async () => {
+    // Only the first load shows the spinner; live reloads swap the data in place
     try {
-      setLoading(true);
-      
       // Fetch dashboard stats
       const statsResponse = await axios.get(`${API}/dashboard/stats`);
       setStats(statsResponse.data);
@@ -59,9 +178,11 @@ const Dashboard = () => {
       const leadsResponse = await axios.get(`${API}/leads`);
       setRecentLeads(leadsResponse.data.slice(0, 5));
 
+      return statsResponse.data;
     } catch (error) {
       console.error('Error fetching dashboard data:', error);
       setError('Failed to load dashboard data');
+      return null;
     } finally {
       setLoading(false);
     }
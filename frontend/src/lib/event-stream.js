@@ -0,0 +1,69 @@
+import axios from 'axios';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+const RECONNECT_DELAY_MS = 3000;
+
+// Event ids are "<server instance>-<sequence>". Returns how far a is after b, or null when they
+// come from different server instances (or either is missing) and cannot be ordered.
+export const compareEventIds = (a, b) => {
+  const [instanceA, sequenceA] = (a || '').split('-');
+  const [instanceB, sequenceB] = (b || '').split('-');
+  if (!instanceA || instanceA !== instanceB) return null;
+  return Number(sequenceA) - Number(sequenceB);
+};
+
+// Opens the live event stream and calls handlers[type](data, eventId) for each event until the
+// returned function is called. A new stream starts with a hello event carrying the id it starts
+// after. A dropped stream is reopened from the last event handled and replays what it missed, or
+// sends stats.stale when it cannot.
+export const openEventStream = (handlers) => {
+  let source = null;
+  let retryTimer = null;
+  let stopped = false;
+  let lastEventId = null;
+
+  const scheduleReconnect = () => {
+    if (!stopped) retryTimer = setTimeout(connect, RECONNECT_DELAY_MS);
+  };
+
+  const connect = async () => {
+    let token;
+    try {
+      // EventSource cannot send headers, so the URL carries a short-lived stream token, not the login token
+      const response = await axios.post(`${API}/events/token`);
+      token = response.data.token;
+    } catch (error) {
+      scheduleReconnect();
+      return;
+    }
+    if (stopped) return;
+
+    const params = new URLSearchParams({ token });
+    if (lastEventId) params.set('last_event_id', lastEventId);
+    source = new EventSource(`${API}/events/stream?${params}`);
+
+    // The stream token has expired by the time the browser would retry, so reconnect with a new one.
+    // This also covers streams the server ended after evicting them for falling behind.
+    source.addEventListener('error', () => {
+      source.close();
+      scheduleReconnect();
+    });
+
+    Object.entries(handlers).forEach(([type, handler]) => {
+      source.addEventListener(type, (event) => {
+        lastEventId = event.lastEventId || lastEventId;
+        handler(JSON.parse(event.data), event.lastEventId);
+      });
+    });
+  };
+
+  if (typeof EventSource !== 'undefined') connect();
+
+  return () => {
+    stopped = true;
+    clearTimeout(retryTimer);
+    if (source) source.close();
+  };
+};